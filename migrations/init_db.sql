@@ -19,6 +19,9 @@ CREATE TABLE IF NOT EXISTS task (
     updated_at TEXT DEFAULT (datetime('now'))
 );
 
+-- Per-user reminder lookups (/list_reminders, /agenda) seek instead of scan.
+CREATE INDEX IF NOT EXISTS idx_task_user_enabled ON task (user_id, enabled);
+
 
 -- 🧾 Run Table (for logging task executions)
 CREATE TABLE IF NOT EXISTS run (
@@ -62,11 +65,29 @@ CREATE TABLE IF NOT EXISTS order_chat_session (
     active INTEGER DEFAULT 1
 );
 
+-- 🪵 System Logs (orchestrator events and errors)
+CREATE TABLE IF NOT EXISTS system_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_type TEXT,
+    message TEXT,
+    timestamp TEXT
+);
+
 -- Notes table: simple per-user notes stored by chat_id
 CREATE TABLE IF NOT EXISTS note (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_chat_id TEXT NOT NULL,
     text TEXT NOT NULL,
-    created_at TEXT NOT NULL,
-    pinned INTEGER DEFAULT 0
+    created_at INTEGER NOT NULL,  -- unix epoch seconds (UTC)
+    pinned INTEGER DEFAULT 0,
+    deleted_at INTEGER            -- set by delete_note; purged later in bulk
 );
+
+-- Serves list_notes(): per-chat range scan already in display order; the
+-- trailing text column makes it covering so the table is never touched.
+-- Partial on live notes, so soft-deleted rows never enter it. deleted_at is
+-- always NULL here, but the planner only reports the index as covering when
+-- every referenced column (the filter's included) is in it.
+CREATE INDEX IF NOT EXISTS idx_note_live_user_pin_time
+    ON note (user_chat_id, pinned DESC, created_at DESC, text, deleted_at)
+    WHERE deleted_at IS NULL;
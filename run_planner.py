@@ -1,6 +1,8 @@
+from src.db import init_db
 from src.planner import parse_command
 
 if __name__ == "__main__":
+    init_db()
     print("💬 Enter a natural language task (type 'exit' to quit):")
     while True:
         cmd = input(">>> ")
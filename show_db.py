@@ -1,18 +1,16 @@
-from src.db import get_conn
+from src.db import get_conn, init_db
 
+init_db()
 conn = get_conn()
-cur = conn.cursor()
 
 print("\n🧾 Available Tables:")
-for row in cur.execute("SELECT name FROM sqlite_master WHERE type='table';"):
+for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table';"):
     print("-", row[0])
 
 print("\n👥 Users:")
-for row in cur.execute("SELECT * FROM user_registry;"):
+for row in conn.execute("SELECT * FROM user_registry;"):
     print(row)
 
 print("\n🕒 Tasks:")
-for row in cur.execute("SELECT id, type, schedule_rule FROM task;"):
+for row in conn.execute("SELECT id, type, schedule_rule FROM task;"):
     print(row)
-
-conn.close()
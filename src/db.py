@@ -1,44 +1,279 @@
 import os
+import atexit
+import logging
+import queue
 import sqlite3
-from contextlib import closing
+import threading
+import time
+from contextlib import contextmanager, suppress
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
 import json
 
 from .config import DATABASE_URL
 
+logger = logging.getLogger("ai_agent")
+
 # Example: DATABASE_URL = "sqlite:///ai_agent.db"
 DB_FILE = DATABASE_URL.replace("sqlite:///", "")
 
+# journal_mode=WAL is persisted in the database header, so it only needs to be
+# set once per process; the other PRAGMAs are per-connection.
+_wal_enabled = False
+
+
+def _apply_pragmas(conn, readonly=False):
+    """Tune a new connection: WAL journal, relaxed fsync, bigger page cache."""
+    global _wal_enabled
+    if not _wal_enabled and not readonly:
+        conn.execute("PRAGMA journal_mode=WAL")
+        _wal_enabled = True
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA busy_timeout=5000")
+
+
+def _connect(readonly=False, check_same_thread=True):
+    """Open and tune a new connection to DB_FILE."""
+    # Autocommit: single statements commit on their own, multi-statement
+    # work opts in through transaction().
+    if readonly:
+        target = Path(DB_FILE).resolve().as_uri() + "?mode=ro"
+    else:
+        target = DB_FILE
+    logger.debug("Connecting to DB file: %s", target)
+    conn = sqlite3.connect(
+        target,
+        uri=readonly,
+        isolation_level=None,
+        cached_statements=256,
+        check_same_thread=check_same_thread,
+    )
+    _apply_pragmas(conn, readonly=readonly)
+    return conn
+
+
+# Schema of record, shared with the migrations/ folder at the project root.
+SCHEMA_FILE = Path(__file__).resolve().parent.parent / "migrations" / "init_db.sql"
+
+
+_db_ready = False
+
 
 def init_db():
-    schema_file = Path(__file__).parent / "schema.sql"  # <-- define schema_file path
-    if not Path(DB_FILE).exists():
-        conn = sqlite3.connect(DB_FILE)
-        with closing(conn):
-            cur = conn.cursor()
-            with open(schema_file, "r", encoding="utf-8") as f:
-                cur.executescript(f.read())
-            conn.commit()
+    """
+    Create any missing tables and indexes. Call once from application startup.
+
+    The schema script only uses IF NOT EXISTS, so running it against an
+    existing database brings it up to date (e.g. new indexes). Later calls in
+    the same process return immediately.
+    """
+    global _db_ready
+    if _db_ready:
+        return
+    conn = get_conn()
+    _add_missing_columns(conn)
+    conn.executescript(SCHEMA_FILE.read_text(encoding="utf-8"))
+    if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+        _backfill_task_owners(conn)
+        conn.execute("PRAGMA user_version = 1")
+    _db_ready = True
+
+
+def _add_missing_columns(conn):
+    """Bring tables created by an older schema up to the current columns."""
+    note_columns = {
+        row[1]: row[2] for row in conn.execute("PRAGMA table_info(note)")
+    }
+    if note_columns and "deleted_at" not in note_columns:
+        conn.execute("ALTER TABLE note ADD COLUMN deleted_at INTEGER")
+    if note_columns.get("created_at", "INTEGER").upper() != "INTEGER":
+        _rebuild_note_created_at(conn)
+    # Replaced by the partial idx_note_live_user_pin_time.
+    conn.execute("DROP INDEX IF EXISTS idx_note_user_pin_time")
+
+
+def _rebuild_note_created_at(conn):
+    """
+    Convert note.created_at from ISO text to unix seconds.
+
+    Updating the values alone is not enough: the legacy TEXT column would store
+    new epoch ints as text, which sorts below the old ISO strings. SQLite cannot
+    change a column's type, so the table is rebuilt with INTEGER affinity.
+    """
+    with transaction(conn):
+        conn.execute(
+            "UPDATE note SET created_at = "
+            "COALESCE(CAST(strftime('%s', created_at) AS INTEGER), 0) "
+            "WHERE typeof(created_at) = 'text'"
+        )
+        conn.execute("""
+            CREATE TABLE note_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_chat_id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                created_at INTEGER NOT NULL,
+                pinned INTEGER DEFAULT 0,
+                deleted_at INTEGER
+            )
+        """)
+        conn.execute("""
+            INSERT INTO note_new (id, user_chat_id, text, created_at, pinned, deleted_at)
+            SELECT id, user_chat_id, text, created_at, pinned, deleted_at FROM note
+        """)
+        # Indexes go with the old table; the schema script recreates them.
+        conn.execute("DROP TABLE note")
+        conn.execute("ALTER TABLE note_new RENAME TO note")
+
+
+def _backfill_task_owners(conn):
+    """
+    Point task.user_id back at its chat's user_registry row (one-time).
+
+    The registry used to be written with INSERT OR REPLACE, which gave a chat a
+    new id on every message, so older tasks carry owner ids that no longer
+    exist. The owning chat is recovered from the task's own call arguments.
+    """
+    conn.execute("""
+        UPDATE task SET user_id = ur.id
+        FROM user_registry AS ur
+        WHERE ur.chat_id = CAST(COALESCE(
+                  json_extract(task.params_json, '$.calls[0].args.chat_id'),
+                  json_extract(task.params_json, '$.calls[0].args.buyer_chat_id')
+              ) AS TEXT)
+          AND task.user_id IS NOT ur.id
+    """)
+
+
+# sqlite3 connections may not be shared across threads by default, so each
+# thread keeps one connection (and its page cache) for its whole lifetime.
+_tls = threading.local()
 
 
 def get_conn():
-    """Get a new DB connection."""
-    print(f"📂 Connecting to DB file: {DB_FILE}")
-    return sqlite3.connect(DB_FILE)
+    """Return this thread's shared DB connection, opening it on first use."""
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
+        conn = _connect()
+        _tls.conn = conn
+    return conn
+
+
+# The note/task helpers follow WAL's one-writer/many-readers model: reads
+# borrow from a small pool of read-only connections, writes go through a
+# single shared connection serialized by a lock. Both keep their page caches
+# across calls.
+_READER_POOL_SIZE = 4
+_reader_pool = queue.Queue(maxsize=_READER_POOL_SIZE)
+_writer_conn = None
+_writer_lock = threading.Lock()
+
+
+@contextmanager
+def _reader():
+    """Borrow a read-only connection from the pool for the enclosed block."""
+    try:
+        conn = _reader_pool.get_nowait()
+    except queue.Empty:
+        conn = _connect(readonly=True, check_same_thread=False)
+    try:
+        yield conn
+    finally:
+        try:
+            _reader_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+@contextmanager
+def _writer():
+    """Hold the shared writer connection for the enclosed block."""
+    global _writer_conn
+    with _writer_lock:
+        if _writer_conn is None:
+            _writer_conn = _connect(check_same_thread=False)
+        yield _writer_conn
+
+
+def _close_all():
+    # Let SQLite refresh planner statistics from this process's workload
+    # before the writable connections go away.
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        with suppress(sqlite3.Error):
+            conn.execute("PRAGMA optimize")
+        conn.close()
+        _tls.conn = None
+    if _writer_conn is not None:
+        with suppress(sqlite3.Error):
+            _writer_conn.execute("PRAGMA optimize")
+        _writer_conn.close()
+    while not _reader_pool.empty():
+        _reader_pool.get_nowait().close()
+
+
+atexit.register(_close_all)
+
+
+@contextmanager
+def transaction(conn=None):
+    """Run the enclosed statements in one write transaction (BEGIN IMMEDIATE)."""
+    conn = conn or get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+# SQL is kept in module constants so every call hands sqlite3 the same string
+# and hits its prepared-statement cache instead of re-parsing.
+_SQL_INSERT_USER = (
+    "INSERT INTO user (name, chat_id, timezone) VALUES (?, ?, ?) RETURNING id"
+)
+_SQL_INSERT_TASK = (
+    "INSERT INTO task (user_id, type, params_json, schedule_rule, enabled) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+# Single-row inserts read the new id back in the same statement; the plain
+# form is kept for executemany(), which cannot report rowcount with RETURNING.
+_SQL_INSERT_TASK_RETURNING_ID = _SQL_INSERT_TASK + " RETURNING id"
+# Column is 'type' in the table, not 'task_type'
+_SQL_LIST_TASKS = "SELECT id, type, params_json, schedule_rule, enabled FROM task"
+_SQL_INSERT_NOTE = """
+    INSERT INTO note (user_chat_id, text, created_at)
+    VALUES (?, ?, ?)
+"""
+_SQL_INSERT_NOTE_RETURNING_ID = _SQL_INSERT_NOTE + "RETURNING id"
+_SQL_LIST_NOTES = """
+    SELECT id, text, created_at, pinned
+    FROM note
+    WHERE user_chat_id = ? AND deleted_at IS NULL
+    ORDER BY pinned DESC, created_at DESC
+"""
+# Deleting only stamps deleted_at; rows are removed later by sweep().
+_SQL_DELETE_NOTE = """
+    UPDATE note
+    SET deleted_at = ?
+    WHERE user_chat_id = ? AND id = ? AND deleted_at IS NULL
+"""
+_SQL_SWEEP_NOTES = "DELETE FROM note WHERE deleted_at < ?"
+_SQL_SET_PIN = """
+    UPDATE note
+    SET pinned = ?
+    WHERE user_chat_id = ? AND id = ? AND deleted_at IS NULL
+"""
 
 
 def create_user(name: str, chat_id: str, timezone: str = "Asia/Kolkata"):
     """Create a new user in the user table."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO user (name, chat_id, timezone) VALUES (?, ?, ?)",
-        (name, chat_id, timezone),
-    )
-    conn.commit()
-    user_id = cur.lastrowid
-    conn.close()
+    with _writer() as conn:
+        cur = conn.execute(_SQL_INSERT_USER, (name, chat_id, timezone))
+        user_id = cur.fetchone()[0]
     return user_id
 
 
@@ -50,124 +285,136 @@ def create_task(
     enabled: int = 1,
 ):
     """Create a new task linked to a user."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO task (user_id, type, params_json, schedule_rule, enabled) "
-        "VALUES (?, ?, ?, ?, ?)",
-        (user_id, task_type, json.dumps(plan), schedule_rule, enabled),
-    )
-    conn.commit()
-    task_id = cur.lastrowid
-    conn.close()
+    with _writer() as conn:
+        task_id = conn.execute(
+            _SQL_INSERT_TASK_RETURNING_ID,
+            (user_id, task_type, json.dumps(plan), schedule_rule, enabled),
+        ).fetchone()[0]
     return task_id
 
 
+def create_tasks(user_id: int, tasks):
+    """
+    Create several tasks for one user in a single transaction.
+
+    tasks: iterable of (task_type, plan, schedule_rule) tuples.
+    Prefer this over repeated create_task() calls when inserting more than
+    one row. Returns the number of tasks inserted.
+    """
+    with _writer() as conn, transaction(conn):
+        cur = conn.executemany(
+            _SQL_INSERT_TASK,
+            (
+                (user_id, task_type, json.dumps(plan), schedule_rule, 1)
+                for task_type, plan, schedule_rule in tasks
+            ),
+        )
+    return cur.rowcount
+
+
 def list_tasks():
     """Return all tasks (helper; not heavily used right now)."""
-    conn = get_conn()
-    cur = conn.cursor()
-    # Column is 'type' in the table, not 'task_type'
-    cur.execute(
-        "SELECT id, type, params_json, schedule_rule, enabled FROM task"
+    with _reader() as conn:
+        return conn.execute(_SQL_LIST_TASKS).fetchall()
+
+
+# -------------------- Notes helpers --------------------
+def format_note_time(created_at) -> str:
+    """Render a note's created_at (unix seconds, UTC) as a readable string."""
+    return datetime.fromtimestamp(int(created_at), timezone.utc).strftime(
+        "%Y-%m-%d %H:%M"
     )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
 
-# Auto initialize database if missing
-init_db()
+# How long soft-deleted notes are kept before sweep() removes them for good.
+NOTE_PURGE_AFTER = 24 * 3600
 
 
-# -------------------- Notes helpers --------------------
-def create_note(user_chat_id: str, text: str) -> int:
-    """Create a new note for this Telegram chat_id. Returns the note's id."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO note (user_chat_id, text, created_at)
-        VALUES (?, ?, ?)
-        """,
-        (user_chat_id, text, datetime.utcnow().isoformat()),
-    )
-    conn.commit()
-    note_id = cur.lastrowid
-    conn.close()
-    return note_id
+class NoteStore:
+    """Per-chat notes CRUD on top of the shared reader pool and writer."""
 
+    def create(self, user_chat_id: str, text: str) -> int:
+        """Create a new note for this Telegram chat_id. Returns the note's id."""
+        with _writer() as conn:
+            return conn.execute(
+                _SQL_INSERT_NOTE_RETURNING_ID,
+                (user_chat_id, text, int(time.time())),
+            ).fetchone()[0]
 
-def list_notes(user_chat_id: str):
-    """
-    Return a list of (id, text, created_at, pinned) for notes of this chat_id.
+    def create_many(self, user_chat_id: str, texts) -> int:
+        """
+        Create several notes for this chat_id in a single transaction.
 
-    Pinned notes come first, then others by newest created_at.
-    """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
+        Prefer this over repeated create() calls when importing more than
+        one note. Returns the number of notes inserted.
         """
-        SELECT id, text, created_at, pinned
-        FROM note
-        WHERE user_chat_id = ?
-        ORDER BY pinned DESC, created_at DESC
-        """,
-        (user_chat_id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+        # One timestamp for the whole batch; parameters are streamed from a
+        # generator rather than built up as a list first.
+        ts = int(time.time())
+        with _writer() as conn, transaction(conn):
+            cur = conn.executemany(
+                _SQL_INSERT_NOTE, ((user_chat_id, text, ts) for text in texts)
+            )
+        return cur.rowcount
 
+    def for_chat(self, user_chat_id: str):
+        """
+        Return a list of (id, text, created_at, pinned) for notes of this chat_id.
 
-def delete_note(user_chat_id: str, note_id: int) -> bool:
-    """Delete a note belonging to this chat_id. Returns True if deleted."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
+        Pinned notes come first, then others by newest created_at.
         """
-        DELETE FROM note
-        WHERE user_chat_id = ? AND id = ?
-        """,
-        (user_chat_id, note_id),
-    )
-    deleted = cur.rowcount > 0
-    conn.commit()
-    conn.close()
-    return deleted
+        with _reader() as conn:
+            return conn.execute(_SQL_LIST_NOTES, (user_chat_id,)).fetchall()
 
+    def delete(self, user_chat_id: str, note_id: int) -> bool:
+        """Delete a note belonging to this chat_id. Returns True if deleted."""
+        with _writer() as conn:
+            cur = conn.execute(
+                _SQL_DELETE_NOTE, (int(time.time()), user_chat_id, note_id)
+            )
+            return cur.rowcount > 0
 
-def pin_note(user_chat_id: str, note_id: int) -> bool:
-    """Mark a note as pinned (pinned = 1). Returns True if updated."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE note
-        SET pinned = 1
-        WHERE user_chat_id = ? AND id = ?
-        """,
-        (user_chat_id, note_id),
-    )
-    updated = cur.rowcount > 0
-    conn.commit()
-    conn.close()
-    return updated
+    def sweep(self, max_age: int = NOTE_PURGE_AFTER) -> int:
+        """Purge notes deleted more than max_age seconds ago. Returns the count."""
+        with _writer() as conn, transaction(conn):
+            cur = conn.execute(_SQL_SWEEP_NOTES, (int(time.time()) - max_age,))
+        return cur.rowcount
 
+    def _set_pin(self, user_chat_id: str, note_id: int, pinned: int) -> bool:
+        """Set the pinned flag of a note. Returns True if updated."""
+        with _writer() as conn:
+            cur = conn.execute(_SQL_SET_PIN, (pinned, user_chat_id, note_id))
+            return cur.rowcount > 0
 
-def unpin_note(user_chat_id: str, note_id: int) -> bool:
-    """Remove pinned mark from a note (pinned = 0). Returns True if updated."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE note
-        SET pinned = 0
-        WHERE user_chat_id = ? AND id = ?
-        """,
-        (user_chat_id, note_id),
-    )
-    updated = cur.rowcount > 0
-    conn.commit()
-    conn.close()
-    return updated
+    def pin(self, user_chat_id: str, note_id: int) -> bool:
+        """Mark a note as pinned (pinned = 1). Returns True if updated."""
+        return self._set_pin(user_chat_id, note_id, 1)
+
+    def unpin(self, user_chat_id: str, note_id: int) -> bool:
+        """Remove pinned mark from a note (pinned = 0). Returns True if updated."""
+        return self._set_pin(user_chat_id, note_id, 0)
+
+
+notes = NoteStore()
+
+# Module-level names kept for existing callers; bound once at import.
+create_note = notes.create
+create_notes = notes.create_many
+list_notes = notes.for_chat
+delete_note = notes.delete
+pin_note = notes.pin
+unpin_note = notes.unpin
+sweep_deleted_notes = notes.sweep
+
+
+def maintenance():
+    """
+    Periodic upkeep for long-running processes; call from a scheduler.
+
+    Purges old soft-deleted notes, checkpoints and truncates the WAL file so
+    it cannot grow unbounded, and refreshes query-planner statistics.
+    """
+    sweep_deleted_notes()
+    with _writer() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("PRAGMA optimize")
@@ -1,4 +1,5 @@
 # src/mcp.py
+import logging
 from typing import Dict, Any
 from src.tools import (
     gmail_oauth,
@@ -10,6 +11,8 @@ from src.tools import (
     orders
 )
 
+logger = logging.getLogger("ai_agent")
+
 # ✅ MCP Tool Map
 TOOL_MAP = {
     "messaging.send_message": messaging.send_message,
@@ -31,5 +34,5 @@ def run_call(call: Dict[str, Any]):
     if not fn:
         raise Exception(f"❌ Tool '{tool}' not found in TOOL_MAP.")
 
-    print(f"⚙️ MCP executing tool: {tool} with args: {args}")
+    logger.debug("⚙️ MCP executing tool: %s with args: %s", tool, args)
     return fn(**args)
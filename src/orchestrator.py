@@ -11,25 +11,11 @@ def log_event(event_type: str, message: str):
     Logs events and errors to the database for debugging and traceability.
     """
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS system_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                event_type TEXT,
-                message TEXT,
-                timestamp TEXT
-            )
-            """
-        )
-        conn.commit()
-        cur.execute(
+        # system_logs is created by init_db()
+        get_conn().execute(
             "INSERT INTO system_logs (event_type, message, timestamp) VALUES (?, ?, ?)",
             (event_type, message, datetime.utcnow().isoformat()),
         )
-        conn.commit()
-        conn.close()
     except Exception as e:
         print(f"⚠️ Log insert failed: {e}")
 
@@ -68,10 +54,7 @@ def run_task_from_db(task_id: int):
     """
     try:
         conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT params_json FROM task WHERE id=?", (task_id,))
-        row = cur.fetchone()
-        conn.close()
+        row = conn.execute("SELECT params_json FROM task WHERE id=?", (task_id,)).fetchone()
 
         if not row:
             print(f"⚠️ Task ID {task_id} not found in DB.")
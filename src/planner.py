@@ -25,22 +25,24 @@ def call_ollama(prompt: str):
         return None
 
 
+_JSON_BLOCK_RE = re.compile(r'\{[\s\S]*\}')
+_JSON_COMMENT_RE = re.compile(r'//.*')
+_JSON_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+
+
 def extract_json_from_text(text: str):
     """
     Extract and parse the first valid JSON object from a text string.
     Handles messy LLM responses gracefully.
     """
     # find first {...} block
-    match = re.search(r'\{[\s\S]*\}', text)
+    match = _JSON_BLOCK_RE.search(text)
     if not match:
         raise ValueError("No JSON object found in text")
 
-    json_str = match.group(0)
-
-    # remove trailing commas and comments (// style)
-    json_str = re.sub(r'//.*', '', json_str)
-    json_str = re.sub(r',\s*}', '}', json_str)
-    json_str = re.sub(r',\s*]', ']', json_str)
+    # remove comments (// style), then trailing commas
+    json_str = _JSON_COMMENT_RE.sub('', match.group(0))
+    json_str = _JSON_TRAILING_COMMA_RE.sub(r'\1', json_str)
 
     return json.loads(json_str)
 
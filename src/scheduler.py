@@ -92,9 +92,7 @@ def parse_rrule_to_kwargs(rrule_str: str):
 
 def register_all_tasks(sched):
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, schedule_rule FROM task WHERE enabled=1")
-    rows = cur.fetchall()
+    rows = conn.execute("SELECT id, schedule_rule FROM task WHERE enabled=1").fetchall()
     for tid, rule in rows:
         try:
             trigger_type, kwargs = parse_rrule_to_kwargs(rule)
@@ -107,7 +105,6 @@ def register_all_tasks(sched):
             print(f"🕒 Registered task {tid} ({trigger_type}: {kwargs})")
         except Exception as e:
             logger.error(f"⚠️ Could not register task {tid}: {e}")
-    conn.close()
 
 
 def start():
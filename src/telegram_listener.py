@@ -1,17 +1,21 @@
 import os
 import time
+import logging
 import json
 import re
+import functools
+import importlib
+import queue
 import threading
 import datetime
-import requests
-import pytz
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.interval import IntervalTrigger
-from src.tools.pdf_export import generate_notes_pdf
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.jobstores.base import JobLookupError
 
 # --- Load environment ---
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "../.env"))
@@ -26,17 +30,69 @@ from src.db import (
     delete_note,
     pin_note,
     unpin_note,
+    maintenance,
 )
-from src.tools.messaging import send_message
-from src.tools import orders
-from src.planner import call_ollama, extract_json_from_text
+from src.tools import messaging
+from src.tools.messaging import OutBuffer, TG_SESSION, md_escape
+from src.tools import orders, email_summary
+from src.mcp import run_call
 from src.tools import gmail_oauth
+from src.utils import setup_logger, short_hash
+
+logger = logging.getLogger("ai_agent")
+
+# Replies to the chat whose update is being handled are buffered per thread
+# and sent together when process_message finishes (see OutBuffer).
+_reply = threading.local()
+
+
+def send_message(chat_id, text, parse_mode=None):
+    buf = getattr(_reply, "buf", None)
+    if buf is not None and str(chat_id) == _reply.chat_id:
+        buf.add(text, parse_mode)
+    else:
+        messaging.send_message(chat_id, text, parse_mode=parse_mode)
+
+
+def _flush_replies():
+    """Send buffered replies now, e.g. before another module messages the same chat."""
+    buf = getattr(_reply, "buf", None)
+    if buf is not None:
+        buf.flush(_reply.chat_id)
+
+
+def _lazy(module, name):
+    """Stand-in for module.name that imports it on first call."""
+    fn = None
+
+    def call(*args, **kwargs):
+        nonlocal fn
+        if fn is None:
+            fn = getattr(importlib.import_module(module), name)
+        return fn(*args, **kwargs)
+
+    return call
+
+
+# Only /remind (planner) and /export_notes (reportlab) need these; keep them
+# off the startup path so the scheduler and restored reminders come up first.
+call_ollama = _lazy("src.planner", "call_ollama")
+extract_json_from_text = _lazy("src.planner", "extract_json_from_text")
+render_notes_pdf = _lazy("src.tools.pdf_export", "render_notes_pdf")
 
 # --- Init DB and Scheduler ---
 init_db()
-TZ = pytz.timezone("Asia/Kolkata")
+TZ = ZoneInfo("Asia/Kolkata")
+TIME_FMT = "%Y-%m-%d %H:%M:%S"
 scheduler = BackgroundScheduler(timezone=TZ)
 scheduler.start()
+# Purge soft-deleted notes, checkpoint the WAL and refresh planner stats.
+scheduler.add_job(
+    maintenance,
+    trigger=IntervalTrigger(minutes=30, timezone=TZ),
+    id="db-maintenance",
+    replace_existing=True,
+)
 
 # --- Environment and Telegram setup ---
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -50,19 +106,28 @@ OFFSET_FILE = os.path.join(os.path.dirname(__file__), ".tg_offset")
 # ---------------------------------------------------
 # Helper Utilities
 # ---------------------------------------------------
+# One pass over the rule: fix FREQ typos, drop EVERYDAY and any UNTIL part.
+_RRULE_FIX = re.compile(r"FREQ=(MINUTES?|HOURS?|DAYS?)\b|EVERYDAY|;?UNTIL=[^;]+")
+_FREQ_MAP = {
+    "MINUTE": "MINUTELY",
+    "MINUTES": "MINUTELY",
+    "HOUR": "HOURLY",
+    "HOURS": "HOURLY",
+    "DAY": "DAILY",
+    "DAYS": "DAILY",
+}
+
+
+def _rrule_fix(m):
+    freq = m.group(1)
+    return "FREQ=" + _FREQ_MAP[freq] if freq else ""
+
+
 def normalize_rrule(rr):
     """Fixes common LLM or user-generated RRULE typos."""
     if not rr:
         return rr
-    rr = rr.strip()
-    rr = rr.replace("FREQ=MINUTE", "FREQ=MINUTELY")
-    rr = rr.replace("FREQ=MINUTES", "FREQ=MINUTELY")
-    rr = rr.replace("FREQ=HOUR", "FREQ=HOURLY")
-    rr = rr.replace("FREQ=HOURS", "FREQ=HOURLY")
-    rr = rr.replace("FREQ=DAY", "FREQ=DAILY")
-    rr = rr.replace("FREQ=DAYS", "FREQ=DAILY")
-    rr = rr.replace("EVERYDAY", "")
-    rr = re.sub(r";?UNTIL=[^;]+", "", rr)
+    rr = _RRULE_FIX.sub(_rrule_fix, rr.strip())
     if not rr.startswith("RRULE:"):
         rr = "RRULE:" + rr
     return rr
@@ -76,55 +141,134 @@ def load_offset():
         return None
 
 
-def save_offset(offset):
-    try:
-        with open(OFFSET_FILE, "w") as f:
+# Serializes the background writer and the final write on shutdown; offsets
+# only grow, so a write older than the last one on disk is dropped.
+_offset_lock = threading.Lock()
+_offset_written = 0
+
+
+def _write_offset(offset):
+    global _offset_written
+    with _offset_lock:
+        if offset <= _offset_written:
+            return
+        # Write-then-rename so a crash never leaves a truncated offset file.
+        tmp = OFFSET_FILE + ".tmp"
+        with open(tmp, "w") as f:
             f.write(str(offset))
-    except Exception:
-        pass
+        os.replace(tmp, OFFSET_FILE)
+        _offset_written = offset
+
+
+# Single slot: only the newest offset matters, so a pending one is replaced.
+_offset_q = queue.Queue(maxsize=1)
+
+
+def _offset_writer():
+    while True:
+        offset = _offset_q.get()
+        try:
+            _write_offset(offset)
+        except Exception as e:
+            logger.error("⚠️ Failed to save poll offset %s: %s", offset, e)
+
+
+threading.Thread(target=_offset_writer, name="offset-writer", daemon=True).start()
+
+
+def save_offset(offset):
+    """Hand the offset to the background writer; never blocks the poll loop."""
+    while True:
+        try:
+            _offset_q.put_nowait(offset)
+            return
+        except queue.Full:
+            try:
+                _offset_q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+# chat_id -> time.monotonic() of the last user_registry write for that chat.
+_registry_touched = {}
+REGISTRY_TOUCH_INTERVAL = 60  # seconds
+# (epoch second, its ISO string in TZ): last_seen only needs 1s resolution.
+_LAST_TS_CACHE = (0, "")
+
+
+def _now_iso():
+    global _LAST_TS_CACHE
+    sec = int(time.time())
+    if sec != _LAST_TS_CACHE[0]:
+        _LAST_TS_CACHE = (sec, datetime.datetime.fromtimestamp(sec, TZ).isoformat())
+    return _LAST_TS_CACHE[1]
 
 
 def register_user(chat_id, name, username):
-    """Auto-register/update a user."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS user_registry (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id TEXT UNIQUE,
-            name TEXT,
-            username TEXT,
-            last_seen TEXT
-        )
-    """
-    )
-    conn.commit()
-    now = datetime.datetime.now(TZ).isoformat()
-    cur.execute("""
-        INSERT OR REPLACE INTO user_registry (chat_id, name, username, last_seen)
+    """Auto-register/update a user (at most once a minute per chat)."""
+    chat_id = str(chat_id)
+    t = time.monotonic()
+    last = _registry_touched.get(chat_id)
+    if last is not None and t - last < REGISTRY_TOUCH_INTERVAL:
+        return
+    now = _now_iso()
+    # Upsert in place: unlike INSERT OR REPLACE this keeps the row (and its id)
+    # and only rewrites it when last_seen actually moves forward.
+    get_conn().execute("""
+        INSERT INTO user_registry (chat_id, name, username, last_seen)
         VALUES (?, ?, ?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET
+            last_seen = excluded.last_seen,
+            name = excluded.name,
+            username = excluded.username
+        WHERE user_registry.last_seen IS NULL
+           OR user_registry.last_seen < excluded.last_seen
     """,
-        (str(chat_id), name, username, now),
+        (chat_id, name, username, now),
     )
-    conn.commit()
-    conn.close()
+    _registry_touched[chat_id] = t
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_params(task_id, params_json):
+    """Decoded task params. Keyed on the JSON text itself, so an edited task
+    simply misses the cache; the returned dict is shared and must not be mutated."""
+    return json.loads(params_json)
+
+
+def task_owner_id(chat_id):
+    """user_registry id that owns this chat's tasks (None if unregistered)."""
+    r = get_conn().execute(
+        "SELECT id FROM user_registry WHERE chat_id=?", (str(chat_id),)
+    ).fetchone()
+    return r[0] if r else None
 
 
 # ---------------------------------------------------
 # RRULE Parsing + Scheduling
 # ---------------------------------------------------
-def parse_rrule_to_interval_kwargs(rrule_str: str):
-    """Parses iCalendar RRULE strings and returns Interval or Cron triggers."""
-    if not rrule_str or not rrule_str.startswith("RRULE:"):
-        return None
+_INTERVAL_UNITS = {
+    "SECONDLY": "seconds",
+    "MINUTELY": "minutes",
+    "HOURLY": "hours",
+    "DAILY": "days",
+    "WEEKLY": "weeks",
+}
+
+
+@functools.lru_cache(maxsize=512)
+def _parse_rrule_cached(rrule_str: str):
+    """
+    Parse an RRULE once per distinct string.
+    Returns ("cron", kwargs) / ("interval", kwargs) with kwargs as a tuple of
+    pairs (hashable, so safe to cache), or None. Triggers are built by the caller.
+    """
     try:
         parts = {}
-        rule = rrule_str.replace("RRULE:", "")
-        for kv in rule.split(";"):
+        for kv in rrule_str[len("RRULE:"):].upper().split(";"):
             if "=" in kv:
                 k, v = kv.split("=", 1)
-                parts[k.strip().upper()] = v.strip().upper()
+                parts[k.strip()] = v.strip()
 
         freq = parts.get("FREQ", "MINUTELY")
         interval = int(parts.get("INTERVAL", 1))
@@ -137,66 +281,75 @@ def parse_rrule_to_interval_kwargs(rrule_str: str):
             hour = int(byhour) if byhour else 9
             minute = int(byminute) if byminute else 0
             day_of_week = byday if byday else "*"
-            cron = CronTrigger(day_of_week=day_of_week, hour=hour, minute=minute, timezone=TZ)
-            print(f"🗓️ CronTrigger parsed: {day_of_week} at {hour}:{minute}")
-            return cron
+            logger.debug("🗓️ CronTrigger parsed: %s at %s:%s", day_of_week, hour, minute)
+            return "cron", (("day_of_week", day_of_week), ("hour", hour), ("minute", minute))
 
         # Interval → simple repetition
-        mapping = {
-            "SECONDLY": {"seconds": interval},
-            "MINUTELY": {"minutes": interval},
-            "HOURLY": {"hours": interval},
-            "DAILY": {"days": interval},
-            "WEEKLY": {"weeks": interval},
-        }
-        print(f"⏱️ IntervalTrigger parsed: every {interval} {freq.lower()[:-2]}")
-        return mapping.get(freq)
+        unit = _INTERVAL_UNITS.get(freq)
+        logger.debug("⏱️ IntervalTrigger parsed: every %s %s", interval, freq)
+        return ("interval", ((unit, interval),)) if unit else None
     except Exception as e:
-        print(f"⚠️ parse_rrule_to_interval_kwargs error: {e}")
+        logger.warning("⚠️ parse_rrule_to_interval_kwargs error: %s", e)
         return None
 
 
+def parse_rrule_to_interval_kwargs(rrule_str: str):
+    """Parses iCalendar RRULE strings and returns Interval or Cron triggers."""
+    if not rrule_str or not rrule_str.startswith("RRULE:"):
+        return None
+    parsed = _parse_rrule_cached(rrule_str)
+    if parsed is None:
+        return None
+    kind, kwargs = parsed
+    if kind == "cron":
+        return CronTrigger(timezone=TZ, **dict(kwargs))
+    return dict(kwargs)
+
+
+# job_id -> fingerprint of the rule + params it was last scheduled with.
+_JOB_FINGERPRINT = {}
+
+
 def schedule_job_for_task(task_id: int, params: dict, schedule_rule: str):
     """Schedules a job with APScheduler and MCP execution."""
     job_id = f"reminder-{task_id}"
-    existing = scheduler.get_job(job_id)
-    if existing:
-        scheduler.remove_job(job_id)
+    fp = short_hash(schedule_rule + json.dumps(params, sort_keys=True))
+    # Unchanged and still pending (one-shot jobs drop out once they fire).
+    if _JOB_FINGERPRINT.get(job_id) == fp and scheduler.get_job(job_id):
+        return True
 
     def _run_plan(p=params):
-        from src.mcp import run_call
         try:
             for call in p.get("calls", []):
-                print(f"⚙️ Scheduler dispatching via MCP: {call}")
+                logger.debug("⚙️ Scheduler dispatching via MCP: %s", call)
                 run_call(call)
         except Exception as e:
-            print(f"⚠️ _run_plan error: {e}")
+            logger.error("⚠️ _run_plan error: %s", e)
 
-    print(f"🧩 Scheduling rule parsing: {schedule_rule}")
+    logger.debug("🧩 Scheduling rule parsing: %s", schedule_rule)
     try:
         # One-time rule
         if "FREQ=ONCE" in schedule_rule:
             run_dt = datetime.datetime.now(TZ) + datetime.timedelta(seconds=60)
-            scheduler.add_job(_run_plan, trigger=DateTrigger(run_date=run_dt), id=job_id, replace_existing=True)
-            return True
-
-        kw = parse_rrule_to_interval_kwargs(schedule_rule)
-        if isinstance(kw, CronTrigger):
-            scheduler.add_job(_run_plan, trigger=kw, id=job_id, replace_existing=True)
-            print(f"✅ Job scheduled (CronTrigger)")
-            return True
-        elif kw:
-            trig = IntervalTrigger(timezone=TZ, **kw)
-            scheduler.add_job(_run_plan, trigger=trig, id=job_id, replace_existing=True)
-            print(f"✅ Job scheduled (IntervalTrigger)")
-            return True
+            trig = DateTrigger(run_date=run_dt)
         else:
-            run_dt = datetime.datetime.now(TZ) + datetime.timedelta(seconds=60)
-            scheduler.add_job(_run_plan, trigger=DateTrigger(run_date=run_dt), id=job_id, replace_existing=True)
-            print(f"⚙️ Fallback job scheduled in 60s")
-            return True
+            kw = parse_rrule_to_interval_kwargs(schedule_rule)
+            if isinstance(kw, CronTrigger):
+                trig = kw
+                logger.debug("✅ Job scheduled (CronTrigger)")
+            elif kw:
+                trig = IntervalTrigger(timezone=TZ, **kw)
+                logger.debug("✅ Job scheduled (IntervalTrigger)")
+            else:
+                run_dt = datetime.datetime.now(TZ) + datetime.timedelta(seconds=60)
+                trig = DateTrigger(run_date=run_dt)
+                logger.debug("⚙️ Fallback job scheduled in 60s")
+        # replace_existing swaps out any earlier job for this task in one call
+        scheduler.add_job(_run_plan, trigger=trig, id=job_id, replace_existing=True)
+        _JOB_FINGERPRINT[job_id] = fp
+        return True
     except Exception as e:
-        print(f"⚠️ schedule_job_for_task error: {e}")
+        logger.error("⚠️ schedule_job_for_task error: %s", e)
         return False
 
 
@@ -223,909 +376,1013 @@ def persist_task_and_schedule(user_chat_id: str, plan_obj: dict):
             "text": plan_obj.get("text", "Reminder"),
         }
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM user_registry WHERE chat_id=?", (str(user_chat_id),))
-    r = cur.fetchone()
-    user_id = r[0] if r else 1
-    conn.close()
+    user_id = task_owner_id(user_chat_id)
+    if user_id is None:
+        # Legacy default owner for chats not in the registry yet.
+        user_id = 1
 
     try:
         tid = create_task(user_id, plan_obj.get("task_type", "reminder"), internal,
                           plan_obj.get("schedule_rule", "RRULE:FREQ=MINUTELY;INTERVAL=1"), 1)
     except Exception:
         conn = get_conn()
-        cur = conn.cursor()
-        cur.execute(
+        cur = conn.execute(
             "INSERT INTO task (user_id, task_type, params_json, schedule_rule, enabled) VALUES (?, ?, ?, ?, ?)",
             (user_id, plan_obj.get("task_type", "reminder"), json.dumps(internal),
              plan_obj.get("schedule_rule", "RRULE:FREQ=MINUTELY;INTERVAL=1"), 1)
         )
-        conn.commit()
         tid = cur.lastrowid
-        conn.close()
 
     rule = normalize_rrule(plan_obj.get("schedule_rule", ""))
+    # Callers send their own confirmation; no second message from here.
     scheduled = schedule_job_for_task(tid, internal, rule)
-    if scheduled:
-        send_message(user_chat_id, f"✅ Reminder scheduled and active (task id={tid}).")
     return tid if scheduled else None
 def schedule_place_order(delay_seconds, buyer_chat_id, store_identifier, item):
     """
     Schedule a one-time order placement after a given delay (in seconds).
-    This runs in a background thread (non-persistent).
+    Runs as a one-shot job on the shared scheduler (non-persistent).
     """
     def job():
         try:
-            print(f"🕒 Placing scheduled order for '{item}' from '{store_identifier}' after {delay_seconds}s delay.")
+            logger.info("🕒 Placing scheduled order for '%s' from '%s' after %ss delay.", item, store_identifier, delay_seconds)
             orders.place_order(str(buyer_chat_id), store_identifier, item)
         except Exception as e:
-            print("⚠️ scheduled order failed:", e)
+            logger.error("⚠️ scheduled order failed: %s", e)
 
     try:
         delay_seconds = max(0, int(delay_seconds))
     except Exception:
         delay_seconds = 0
 
-    t = threading.Timer(delay_seconds, job)
-    t.daemon = True
-    t.start()
-    print(f"✅ Scheduled one-time order for '{item}' in {delay_seconds} seconds.")
-    return t
+    run_at = datetime.datetime.now(TZ) + datetime.timedelta(seconds=delay_seconds)
+    j = scheduler.add_job(
+        job,
+        trigger=DateTrigger(run_date=run_at, timezone=TZ),
+        id=f"order-{buyer_chat_id}-{time.time()}",
+        misfire_grace_time=60,
+    )
+    logger.info("✅ Scheduled one-time order for '%s' in %s seconds.", item, delay_seconds)
+    return j
 
 
 def restore_saved_reminders_from_db():
     """Restore scheduled reminders from DB on startup."""
     try:
         conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT id, params_json, schedule_rule FROM task WHERE enabled=1")
-        rows = cur.fetchall()
-        conn.close()
-        for tid, params_json, rule in rows:
-            params = json.loads(params_json) if isinstance(params_json, str) else params_json
-            schedule_job_for_task(tid, params, rule or "")
+        cur = conn.execute("SELECT id, params_json, schedule_rule FROM task WHERE enabled=1")
+        # Decode every row first so the scheduler is only paused while jobs
+        # are being added.
+        pending = [
+            (tid, _parse_params(tid, params_json) if isinstance(params_json, str) else params_json, rule or "")
+            for tid, params_json, rule in cur.fetchall()
+        ]
     except Exception as e:
-        print("⚠️ Failed to restore reminders:", e)
+        logger.error("⚠️ Failed to restore reminders: %s", e)
+        return
+
+    # Paused, add_job() only queues; resume() wakes the scheduler once for
+    # the whole batch instead of once per job.
+    scheduler.pause()
+    try:
+        for tid, params, rule in pending:
+            schedule_job_for_task(tid, params, rule)
+    finally:
+        scheduler.resume()
 
 
 restore_saved_reminders_from_db()
 
-def process_message(msg):
-    try:
-        chat = msg.get("chat", {})
-        chat_id = str(chat.get("id"))
-        username = chat.get("username")
-        display_name = (
-            chat.get("title")
-            or " ".join(filter(None, [chat.get("first_name"), chat.get("last_name")]))
-            or username
-            or ""
-        )
-        text = msg.get("text") or msg.get("caption") or ""
-        if not text:
-            return
+# Slow user-initiated work (Gmail fetches, Ollama planning) runs here so the
+# polling thread can keep dispatching updates.
+_BG = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tg-bg")
 
-        # keep user registry logic unchanged
-        register_user(chat_id, display_name, username)
-        text_lower = text.strip().lower()
 
-        # keep buyer <-> store chat forwarding logic unchanged
-        try:
-            conn = get_conn()
-            cur = conn.cursor()
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS order_chat_session (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    order_id INTEGER,
-                    buyer_chat_id TEXT,
-                    store_chat_id TEXT,
-                    active INTEGER DEFAULT 1
-                )
-            """
-            )
-            conn.commit()
-            cur.execute(
-                """
-                SELECT id, order_id, buyer_chat_id, store_chat_id
-                FROM order_chat_session
-                WHERE active=1 AND (buyer_chat_id=? OR store_chat_id=?)
-            """,
-                (chat_id, chat_id),
-            )
-            sess = cur.fetchone()
-            conn.close()
-            if sess:
-                sess_id, order_id, buyer_cid, store_cid = sess
-                # endchat preserved
-                if text.strip().lower() == "/endchat":
-                    conn = get_conn()
-                    cur = conn.cursor()
-                    cur.execute(
-                        "UPDATE order_chat_session SET active=0 WHERE id=?",
-                        (sess_id,),
-                    )
-                    conn.commit()
-                    conn.close()
-                    send_message(buyer_cid, "💬 Chat closed.")
-                    send_message(store_cid, "💬 Chat closed.")
-                    return
-                target = store_cid if chat_id == buyer_cid else buyer_cid
-                prefix = "👤 Customer" if chat_id == buyer_cid else "🏪 Store"
-                send_message(target, f"{prefix}:\n{text}")
-                return
-        except Exception:
-            pass
+def _log_bg_error(fut):
+    if fut.exception() is not None:
+        logger.error("⚠️ background task failed: %s", fut.exception())
 
-        # ---------------- NOTES FEATURE ----------------
-        # /note <text>  -> create note
-        if text_lower.startswith("/note "):
-            parts = text.split(maxsplit=1)
-            if len(parts) == 1 or not parts[1].strip():
-                send_message(chat_id, "Usage: /note <your note text>")
-                return
-            note_text = parts[1].strip()
-            try:
-                nid = create_note(str(chat_id), note_text)
-                send_message(chat_id, f"📝 Saved note #{nid}: {note_text}")
-            except Exception as e:
-                send_message(chat_id, f"⚠️ Failed to save note: {e}")
-            return
 
-        if text_lower.strip() == "/note":
-            send_message(chat_id, "Usage: /note <your note text>")
-            return
+def _run_in_background(fn, *args):
+    _BG.submit(fn, *args).add_done_callback(_log_bg_error)
 
-        # /notes -> list notes
-        if text_lower.strip() == "/notes":
-            try:
-                rows = list_notes(str(chat_id))
-                if not rows:
-                    send_message(chat_id, "📭 You have no saved notes.")
-                    return
 
-                lines = ["🗒 *Your notes:*"]
-                for nid, note_text, created_at, pinned in rows:
-                    star = "⭐ " if pinned else ""
-                    lines.append(f"{star}{nid}) {note_text}")
+# ---------------------------------------------------
+# Command argument patterns (compiled once at import)
+# ---------------------------------------------------
+# /emailsummary patterns run on the arguments only (text after the command).
+_RE_EMAILSUMMARY_COUNT = re.compile(r"^\s*(\d+)\s*$")
+_RE_EMAILSUMMARY_DAILY = re.compile(
+    r"every\s+day\s+at\s+(\d{1,2})(?::(\d{2}))?\s*(am|pm)?", re.IGNORECASE
+)
+_RE_EMAILSUMMARY_WEEKLY = re.compile(
+    r"(?:every|weekly)\s*(?:week)?(?:\s*on)?\s*"
+    r"(mon|monday|tue|tuesday|wed|wednesday|thu|thursday|fri|friday|sat|saturday|sun|sunday)\b"
+    r"\s*(?:at\s*(\d{1,2})(?::(\d{2}))?\s*(am|pm)?)?",
+    re.IGNORECASE,
+)
+_WEEKDAY_MAP = {
+    "monday": "MO",
+    "mon": "MO",
+    "tuesday": "TU",
+    "tue": "TU",
+    "wednesday": "WE",
+    "wed": "WE",
+    "thursday": "TH",
+    "thu": "TH",
+    "friday": "FR",
+    "fri": "FR",
+    "saturday": "SA",
+    "sat": "SA",
+    "sunday": "SU",
+    "sun": "SU",
+}
+# /remind interval unit -> RRULE FREQ (units are matched on the lowered text)
+_FREQ = {
+    "second": "SECONDLY",
+    "seconds": "SECONDLY",
+    "minute": "MINUTELY",
+    "minutes": "MINUTELY",
+    "hour": "HOURLY",
+    "hours": "HOURLY",
+    "day": "DAILY",
+    "days": "DAILY",
+    "week": "WEEKLY",
+    "weeks": "WEEKLY",
+}
+# /remind one-time order delay unit -> seconds
+_DELAY_SECONDS = {
+    "second": 1,
+    "seconds": 1,
+    "minute": 60,
+    "minutes": 60,
+    "hour": 3600,
+    "hours": 3600,
+    "day": 86400,
+    "days": 86400,
+}
+# Any "every .. <unit>" / "in N<unit>" phrase, spaced or not.
+_RE_REMIND_SCHEDULE = re.compile(
+    r"\b(?:every|in)\s*\d*\s*(?:second|minute|hour|day|week)s?\b", re.IGNORECASE
+)
+_RE_REMIND_EXPLICIT = re.compile(
+    r"(?P<action>.+?)\s+every\s+(?P<num>\d+)\s*"
+    r"(?P<unit>second|seconds|minute|minutes|hour|hours|day|days|week|weeks)\b",
+    re.IGNORECASE,
+)
+
 
-                lines.append("\nUse /pin_note <id> or /unpin_note <id> to manage pins.")
-                send_message(chat_id, "\n".join(lines), parse_mode="Markdown")
-            except Exception as e:
-                send_message(chat_id, f"⚠️ Failed to list notes: {e}")
-            return
+# ---------------------------------------------------
+# Command handlers: handler(chat_id, rest, text), where rest is the text
+# after the command word and text is the full original message.
+# ---------------------------------------------------
+# /note <text>  -> create note
+def _handle_note(chat_id, rest, text):
+    parts = text.split(maxsplit=1)
+    if len(parts) == 1 or not parts[1].strip():
+        send_message(chat_id, "Usage: /note <your note text>")
+        return
+    note_text = parts[1].strip()
+    try:
+        nid = create_note(str(chat_id), note_text)
+        send_message(chat_id, f"📝 Saved note #{nid}: {note_text}")
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Failed to save note: {e}")
 
 
-        # /delete_note <id>
-        if text_lower.startswith("/delete_note"):
-            parts = text.split(maxsplit=1)
-            if len(parts) == 1 or not parts[1].strip():
-                send_message(chat_id, "Usage: /delete_note <note_id>")
-                return
-            arg = parts[1].strip()
-            if not arg.isdigit():
-                send_message(chat_id, "Note id must be a number.")
-                return
-            note_id = int(arg)
-            try:
-                ok = delete_note(str(chat_id), note_id)
-                if ok:
-                    send_message(chat_id, f"🗑 Deleted note #{note_id}.")
-                else:
-                    send_message(chat_id, f"⚠️ No note #{note_id} found.")
-            except Exception as e:
-                send_message(chat_id, f"⚠️ Failed to delete note: {e}")
+# /notes -> list notes
+def _handle_notes(chat_id, rest, text):
+    try:
+        rows = list_notes(str(chat_id))
+        if not rows:
+            send_message(chat_id, "📭 You have no saved notes.")
             return
-        # ---------------- END NOTES FEATURE ----------------
 
-                # /export_notes -> generate and send PDF
-        if text_lower.startswith("/export_notes"):
-            try:
-                notes = list_notes(str(chat_id))
-                if not notes:
-                    send_message(chat_id, "📭 You have no notes to export.")
-                    return
+        lines = ["🗒 *Your notes:*"]
+        for nid, note_text, created_at, pinned in rows:
+            star = "⭐ " if pinned else ""
+            lines.append(f"{star}{nid}) {md_escape(note_text)}")
 
-                pdf_path = f"notes_{chat_id}.pdf"
-                generate_notes_pdf(notes, pdf_path)
+        lines.append("\nUse `/pin_note <id>` or `/unpin_note <id>` to manage pins.")
+        send_message(chat_id, "\n".join(lines), parse_mode="Markdown")
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Failed to list notes: {e}")
+
+
+# /delete_note <id>
+def _handle_delete_note(chat_id, rest, text):
+    parts = text.split(maxsplit=1)
+    if len(parts) == 1 or not parts[1].strip():
+        send_message(chat_id, "Usage: /delete_note <note_id>")
+        return
+    arg = parts[1].strip()
+    if not arg.isdigit():
+        send_message(chat_id, "Note id must be a number.")
+        return
+    note_id = int(arg)
+    try:
+        ok = delete_note(str(chat_id), note_id)
+        if ok:
+            send_message(chat_id, f"🗑 Deleted note #{note_id}.")
+        else:
+            send_message(chat_id, f"⚠️ No note #{note_id} found.")
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Failed to delete note: {e}")
 
-                # Send the PDF file
-                files = {
-                    "document": open(pdf_path, "rb")
-                }
-                data = {
-                    "chat_id": chat_id,
-                    "caption": "📄 Here is your exported notes PDF."
-                }
 
-                requests.post(f"{TG_BASE}/sendDocument", data=data, files=files)
-                send_message(chat_id, "✅ Notes exported successfully!")
+# /export_notes -> generate and send PDF
+def _handle_export_notes(chat_id, rest, text):
+    try:
+        notes = list_notes(str(chat_id))
+        if not notes:
+            send_message(chat_id, "📭 You have no notes to export.")
+            return
 
-            except Exception as e:
-                send_message(chat_id, f"⚠️ Failed to export notes: {e}")
+        # Build the PDF in memory and upload it straight from there
+        pdf_bytes = render_notes_pdf(notes)
+        data = {
+            "chat_id": chat_id,
+            "caption": "📄 Here is your exported notes PDF."
+        }
+        TG_SESSION.post(
+            f"{TG_BASE}/sendDocument",
+            data=data,
+            files={"document": (f"notes_{chat_id}.pdf", pdf_bytes, "application/pdf")},
+        )
+        send_message(chat_id, "✅ Notes exported successfully!")
 
-            return
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Failed to export notes: {e}")
 
 
-        # ---------------- AGENDA FEATURE ----------------
-        # /agenda -> show today's agenda (reminders + notes)
-        if text_lower.startswith("/agenda"):
-            # Get today's date in your bot's timezone
-            now = datetime.datetime.now(TZ)
-            date_str = now.strftime("%A, %d %b %Y")
+# /agenda -> show today's agenda (reminders + notes)
+def _handle_agenda(chat_id, rest, text):
+    # Get today's date in your bot's timezone
+    now = datetime.datetime.now(TZ)
+    date_str = now.strftime("%A, %d %b %Y")
 
-            # 1) Fetch active reminders/orders from task table
-            try:
-                conn = get_conn()
-                cur = conn.cursor()
-                # Same approach as /list_reminders (no per-user filter yet)
-                cur.execute(
-                    "SELECT id, params_json, schedule_rule, enabled "
-                    "FROM task WHERE enabled=1"
-                )
-                task_rows = cur.fetchall()
-                conn.close()
-            except Exception as e:
-                task_rows = []
-                print("⚠️ Failed to fetch tasks for agenda:", e)
-
-            # Format reminders / tasks
-            task_lines = []
-            if task_rows:
-                for tid, params_json, rule, enabled in task_rows:
-                    try:
-                        params = json.loads(params_json)
-                        msg_text = params["calls"][0]["args"].get("text", "")
-                        plan = params.get("plan", "")
-                    except Exception:
-                        msg_text = "(unreadable)"
-                        plan = "unknown"
-                    task_lines.append(f"• [{tid}] ({plan}) {msg_text}  ⏱ {rule}")
+    # 1) Fetch this user's active tasks and live notes in one query
+    task_rows, notes = [], []
+    try:
+        conn = get_conn()
+        cur = conn.execute("""
+            SELECT 'task' AS kind, id, params_json, schedule_rule,
+                   NULL AS created_at, NULL AS pinned
+            FROM task
+            WHERE user_id = (SELECT id FROM user_registry WHERE chat_id = ?)
+              AND enabled = 1
+            UNION ALL
+            SELECT 'note', id, text, NULL, created_at, pinned
+            FROM note
+            WHERE user_chat_id = ? AND deleted_at IS NULL
+            ORDER BY kind, pinned DESC, created_at DESC, id
+        """, (str(chat_id), str(chat_id)))
+        for kind, rid, body, rule, created_at, pinned in cur:
+            if kind == "task":
+                task_rows.append((rid, body, rule))
             else:
-                task_lines.append("• No active reminders or scheduled tasks.")
+                notes.append((rid, body, created_at, pinned))
+    except Exception as e:
+        logger.error("⚠️ Failed to fetch agenda: %s", e)
 
-            # 2) Fetch notes for this chat
+    # Format reminders / tasks
+    task_lines = []
+    if task_rows:
+        for tid, params_json, rule in task_rows:
             try:
-                notes = list_notes(str(chat_id))
-            except Exception as e:
-                notes = []
-                print("⚠️ Failed to fetch notes for agenda:", e)
-
-            note_lines = []
-            if notes:
-                note_lines.append("Here are your latest notes:")
-                # show at most 5
-                for nid, note_text, created_at, pinned in notes[:5]:
-                    star = "⭐ " if pinned else ""
-                    note_lines.append(f"• {star}[{nid}] {note_text}")
-
-                if len(notes) > 5:
-                    note_lines.append(f"... and {len(notes) - 5} more. Use /notes to see all.")
-            else:
-                note_lines.append("You have no saved notes. Use `/note <text>` to add one.")
-
-            # Build final agenda message
-            lines = [
-                f"📅 *Agenda for {date_str}*",
-                "",
-                "🕒 *Reminders & Scheduled Tasks*",
-                *task_lines,
-                "",
-                "📝 *Notes*",
-                *note_lines,
-            ]
-
-            send_message(chat_id, "\n".join(lines), parse_mode="Markdown")
-            return
-        # ---------------- END AGENDA FEATURE ----------------
-
-        # --- /start (updated manual text) ---
-        if text_lower.startswith("/start"):
-            welcome_text = (
-                "👋 Hello! I’m your *AI Micro Agent* — your smart assistant for reminders, "
-                "orders, notes, and Gmail digests.\n\n"
-                "Here’s what I can do:\n\n"
-                "🕒 *Reminders*\n"
-                "• `/remind drink water every 2 hours`\n"
-                "• `/list_reminders` — show all reminders\n"
-                "• `/delete_reminder <id>` — delete one\n\n"
-                "🛒 *Orders*\n"
-                "• `/remind order milk from Capital Store` — place an immediate order\n"
-                "• `/remind order milk in 2 hours from Capital Store` — one-time delayed order\n"
-                "• `/remind order milk every 2 days from Capital Store` — recurring order\n"
-                "• Chat continues until `/endchat`\n\n"
-                "📝 *Notes*\n"
-                "• `/note buy fruits` — save a note\n"
-                "• `/notes` — list your notes\n"
-                "• `/delete_note <id>` — delete a note\n\n"
-                "💌 *Email Digest*\n"
-                "• `/link_gmail` — link Gmail\n"
-                "• `/emailsummary` — fetch immediate summary\n"
-                "• `/emailsummary 10` — fetch last 10 emails\n"
-                "• `/emailsummary every day at 10am` — schedule daily digest\n"
-                "• `/emailsummary weekly on Mon at 9am` — schedule weekly digest\n"
-                "• `/disconnect_gmail` — unlink Gmail\n"
-                "• `/check_gmail` — check Gmail link status\n\n"
-                "🧾 *Jobs & Info*\n"
-                "• `/list_jobs` — show scheduled jobs\n"
-                "• `/whoami` — your profile\n"
-                "• `/manual` — see this guide again\n\n"
-                "Let’s get started! 🚀"
+                params = _parse_params(tid, params_json)
+                msg_text = params["calls"][0]["args"].get("text", "")
+                plan = params.get("plan", "")
+            except Exception:
+                msg_text = "(unreadable)"
+                plan = "unknown"
+            task_lines.append(
+                f"• \\[{tid}] ({md_escape(plan)}) {md_escape(msg_text)}  ⏱ {md_escape(rule)}"
             )
-            send_message(chat_id, welcome_text, parse_mode="Markdown")
-            return
-                # --- /systemcheck command ---
-        if text_lower.startswith("/systemcheck"):
-            from src.mcp import run_call
-            import sqlite3
-
-            send_message(chat_id, "🧠 Running system diagnostic... please wait ⏳")
-
-            # Initialize result dictionary
-            results = {
-                "Messaging": "⚠️ Failed",
-                "Email Summary": "⚠️ Failed",
-                "Orders": "⚠️ Failed",
-                "Scheduler": "⚠️ Not Running",
-                "Database": "⚠️ Connection Failed"
-            }
+    else:
+        task_lines.append("• No active reminders or scheduled tasks.")
+
+    note_lines = []
+    if notes:
+        note_lines.append("Here are your latest notes:")
+        # show at most 5
+        for nid, note_text, created_at, pinned in notes[:5]:
+            star = "⭐ " if pinned else ""
+            note_lines.append(f"• {star}\\[{nid}] {md_escape(note_text)}")
+
+        if len(notes) > 5:
+            note_lines.append(f"... and {len(notes) - 5} more. Use /notes to see all.")
+    else:
+        note_lines.append("You have no saved notes. Use `/note <text>` to add one.")
+
+    # Build final agenda message
+    lines = [
+        f"📅 *Agenda for {date_str}*",
+        "",
+        "🕒 *Reminders & Scheduled Tasks*",
+        *task_lines,
+        "",
+        "📝 *Notes*",
+        *note_lines,
+    ]
+
+    send_message(chat_id, "\n".join(lines), parse_mode="Markdown")
+
+
+_WELCOME_TEXT = (
+    "👋 Hello! I’m your *AI Micro Agent* — your smart assistant for reminders, "
+    "orders, notes, and Gmail digests.\n\n"
+    "Here’s what I can do:\n\n"
+    "🕒 *Reminders*\n"
+    "• `/remind drink water every 2 hours`\n"
+    "• `/list_reminders` — show all reminders\n"
+    "• `/delete_reminder <id>` — delete one\n\n"
+    "🛒 *Orders*\n"
+    "• `/remind order milk from Capital Store` — place an immediate order\n"
+    "• `/remind order milk in 2 hours from Capital Store` — one-time delayed order\n"
+    "• `/remind order milk every 2 days from Capital Store` — recurring order\n"
+    "• Chat continues until `/endchat`\n\n"
+    "📝 *Notes*\n"
+    "• `/note buy fruits` — save a note\n"
+    "• `/notes` — list your notes\n"
+    "• `/delete_note <id>` — delete a note\n\n"
+    "💌 *Email Digest*\n"
+    "• `/link_gmail` — link Gmail\n"
+    "• `/emailsummary` — fetch immediate summary\n"
+    "• `/emailsummary 10` — fetch last 10 emails\n"
+    "• `/emailsummary every day at 10am` — schedule daily digest\n"
+    "• `/emailsummary weekly on Mon at 9am` — schedule weekly digest\n"
+    "• `/disconnect_gmail` — unlink Gmail\n"
+    "• `/check_gmail` — check Gmail link status\n\n"
+    "🧾 *Jobs & Info*\n"
+    "• `/list_jobs` — show scheduled jobs\n"
+    "• `/whoami` — your profile\n"
+    "• `/manual` — see this guide again\n\n"
+    "Let’s get started! 🚀"
+)
 
-            # 1️⃣ Messaging test
-            try:
-                run_call({
-                    "tool": "messaging.send_message",
-                    "args": {"chat_id": chat_id, "text": "✅ Messaging test successful!"}
-                })
-                results["Messaging"] = "✅ OK"
-            except Exception as e:
-                results["Messaging"] = f"❌ {e}"
 
-            # 2️⃣ Email summary test
-            try:
-                run_call({
-                    "tool": "email.summary",
-                    "args": {"chat_id": chat_id}
-                })
-                results["Email Summary"] = "✅ OK"
-            except Exception as e:
-                results["Email Summary"] = f"❌ {e}"
+def _handle_start(chat_id, rest, text):
+    send_message(chat_id, _WELCOME_TEXT, parse_mode="Markdown")
 
-            # 3️⃣ Order system test (dry-run)
-            try:
-                if hasattr(orders, "place_order"):
-                    results["Orders"] = "✅ OK (place_order available)"
-                else:
-                    results["Orders"] = "⚠️ No place_order function"
-            except Exception as e:
-                results["Orders"] = f"❌ {e}"
 
-            # 4️⃣ Scheduler check
-            try:
-                if scheduler.running:
-                    results["Scheduler"] = "✅ Active"
-                else:
-                    results["Scheduler"] = "⚠️ Not running"
-            except Exception:
-                results["Scheduler"] = "❌ Unknown state"
+def _probe_messaging(chat_id):
+    # getMe proves the token and the API are reachable without sending a message
+    TG_SESSION.get(f"{TG_BASE}/getMe", timeout=3).raise_for_status()
+    return "✅ OK"
 
-            # 5️⃣ Database connectivity
-            try:
-                conn = get_conn()
-                cur = conn.cursor()
-                cur.execute("SELECT 1")
-                conn.close()
-                results["Database"] = "✅ Connected"
-            except sqlite3.Error as e:
-                results["Database"] = f"❌ {e}"
-
-            # Format message for Telegram
-            report = "🧠 *System Check Complete*\n\n"
-            for key, val in results.items():
-                report += f"{val} {key}\n"
-
-            send_message(chat_id, report, parse_mode="Markdown")
-            return
-    
-    
-        # --- /whoami (kept) ---
-        if text_lower.startswith("/whoami"):
-            conn = get_conn()
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT name, username, last_seen FROM user_registry WHERE chat_id=?",
-                (chat_id,),
-            )
-            user_info = cur.fetchone()
-            conn.close()
-            if user_info:
-                name, uname, last_seen = user_info
-                send_message(
-                    chat_id,
-                    f"🆔 *Chat ID:* `{chat_id}`\n"
-                    f"👤 *Name:* {name}\n"
-                    f"📛 *Username:* @{uname or '—'}\n"
-                    f"⏱ *Last Seen:* {last_seen}",
-                    parse_mode="Markdown",
-                )
-            else:
-                send_message(
-                    chat_id, "⚠️ You’re not registered yet. Try sending /start."
-                )
-            return
-        
-        # --- /status (kept) ---
-        if text_lower.startswith("/status"):
-            try:
-                conn = get_conn()
-                cur = conn.cursor()
-                cur.execute("SELECT COUNT(*) FROM task WHERE enabled=1")
-                active_tasks = cur.fetchone()[0]
-                cur.execute("SELECT COUNT(*) FROM user_registry")
-                total_users = cur.fetchone()[0]
-                conn.close()
-
-                jobs = scheduler.get_jobs()
-                job_count = len(jobs)
-
-                status_msg = (
-                    f"🧾 *System Status:*\n\n"
-                    f"👥 Total Users: {total_users}\n"
-                    f"🕒 Active Tasks: {active_tasks}\n"
-                    f"🗓️ Scheduled Jobs: {job_count}\n"
-                    f"🕰️ Server Time: {datetime.datetime.now(TZ).strftime('%Y-%m-%d %H:%M:%S')}\n"
-                )
-                send_message(chat_id, status_msg, parse_mode="Markdown")
-            except Exception as e:
-                send_message(chat_id, f"⚠️ Failed to fetch status: {e}")
-            return
-        # 🧾 --- list reminders (kept) ---
-        if text_lower.startswith("/list_reminders"):
-            try:
-                conn = get_conn()
-                cur = conn.cursor()
-                cur.execute(
-                    "SELECT id, params_json, schedule_rule, enabled "
-                    "FROM task WHERE enabled=1"
-                )
-                rows = cur.fetchall()
-                conn.close()
 
-                if not rows:
-                    send_message(chat_id, "ℹ️ You have no active reminders.")
-                    return
+def _probe_email_summary(chat_id):
+    run_call({
+        "tool": "email.summary",
+        "args": {"chat_id": chat_id}
+    })
+    return "✅ OK"
 
-                lines = []
-                for tid, params_json, rule, enabled in rows:
-                    try:
-                        params = json.loads(params_json)
-                        msg_text = params["calls"][0]["args"].get("text", "")
-                        plan = params.get("plan", "")
-                    except Exception:
-                        msg_text = "(unreadable)"
-                        plan = "unknown"
-                    lines.append(
-                        f"🆔 *{tid}* → ({plan}) {msg_text}\n   ⏱ {rule}"
-                    )
 
-                msg_body = (
-                    "📋 *Active Reminders & Orders:*\n\n"
-                    + "\n\n".join(lines)
-                    + "\n\nUse `/delete_reminder <id>` to delete a reminder."
-                )
-                send_message(chat_id, msg_body, parse_mode="Markdown")
-            except Exception as e:
-                send_message(chat_id, f"⚠️ Failed to list reminders: {e}")
-            return
+def _probe_orders(chat_id):
+    if hasattr(orders, "place_order"):
+        return "✅ OK (place_order available)"
+    return "⚠️ No place_order function"
 
-        # ❌ --- delete reminder ---
-        if text_lower.startswith("/delete_reminder"):
-            parts = text.split()
-            if len(parts) < 2:
-                send_message(chat_id, "Usage: /delete_reminder <reminder_id>")
-                return
 
-            try:
-                rid = int(parts[1])
-            except ValueError:
-                send_message(
-                    chat_id, "Please provide a valid numeric reminder ID."
-                )
-                return
+def _probe_scheduler(chat_id):
+    return "✅ Active" if scheduler.running else "⚠️ Not running"
 
-            try:
-                conn = get_conn()
-                cur = conn.cursor()
-                cur.execute("UPDATE task SET enabled=0 WHERE id=?", (rid,))
-                conn.commit()
-                conn.close()
 
-                job_id = f"reminder-{rid}"
-                job = scheduler.get_job(job_id)
-                if job:
-                    job.remove()
+def _probe_database(chat_id):
+    get_conn().execute("SELECT 1")
+    return "✅ Connected"
 
-                send_message(
-                    chat_id,
-                    f"✅ Reminder *{rid}* deleted successfully.",
-                    parse_mode="Markdown",
-                )
-            except Exception as e:
-                send_message(chat_id, f"⚠️ Could not delete reminder {rid}: {e}")
-            return
-        
-        
 
-        # --- /link_gmail command ---
-        if text_lower.startswith("/link_gmail") or text_lower.startswith(
-            "/connect_gmail"
-        ):
-            try:
-                from src.tools.email_summary import start_gmail_oauth
+# Report order matters: results are listed in this order.
+_SYSTEM_PROBES = {
+    "Messaging": _probe_messaging,
+    "Email Summary": _probe_email_summary,
+    "Orders": _probe_orders,
+    "Scheduler": _probe_scheduler,
+    "Database": _probe_database,
+}
+SYSTEMCHECK_TIMEOUT = 10  # seconds
+# Shared pool for fanning out independent calls, e.g. /systemcheck probes
+# (slowest probe, not the sum) and the two /endchat notices.
+_io_pool = ThreadPoolExecutor(
+    max_workers=len(_SYSTEM_PROBES), thread_name_prefix="tg-io"
+)
 
-                send_message(chat_id, "🔗 Starting Gmail link process...")
-                start_gmail_oauth(chat_id)
-            except Exception as e:
-                send_message(chat_id, f"⚠️ Failed to start Gmail linking: {e}")
-            return
 
-        # --- /check_gmail command ---
-        if text_lower.startswith("/check_gmail"):
-            try:
-                from src.tools.email_summary import check_gmail_link
+def _handle_systemcheck(chat_id, rest, text):
+    # A typing indicator instead of a separate "please wait" message
+    try:
+        TG_SESSION.post(
+            f"{TG_BASE}/sendChatAction",
+            data={"chat_id": chat_id, "action": "typing"},
+            timeout=3,
+        )
+    except Exception:
+        pass
 
-                linked = check_gmail_link(chat_id)
-                if linked:
-                    send_message(
-                        chat_id, "✅ Your Gmail is linked successfully."
-                    )
-                else:
-                    send_message(
-                        chat_id,
-                        "⚠️ Your Gmail is not linked yet. Use /link_gmail to link.",
-                    )
-            except Exception as e:
-                send_message(chat_id, f"⚠️ Failed to check Gmail link: {e}")
+    futures = {
+        name: _io_pool.submit(probe, chat_id)
+        for name, probe in _SYSTEM_PROBES.items()
+    }
+    wait(futures.values(), timeout=SYSTEMCHECK_TIMEOUT)
+
+    results = {}
+    for name, fut in futures.items():
+        if not fut.done():
+            results[name] = "⚠️ Timed out"
+        elif fut.exception() is not None:
+            results[name] = f"❌ {fut.exception()}"
+        else:
+            results[name] = fut.result()
+
+    # Format message for Telegram
+    report = "🧠 *System Check Complete*\n\n"
+    for key, val in results.items():
+        report += f"{md_escape(val)} {key}\n"
+
+    send_message(chat_id, report, parse_mode="Markdown")
+
+
+def _handle_whoami(chat_id, rest, text):
+    conn = get_conn()
+    cur = conn.execute(
+        "SELECT name, username, last_seen FROM user_registry WHERE chat_id=?",
+        (chat_id,),
+    )
+    user_info = cur.fetchone()
+    if user_info:
+        name, uname, last_seen = user_info
+        send_message(
+            chat_id,
+            f"🆔 *Chat ID:* `{chat_id}`\n"
+            f"👤 *Name:* {md_escape(name)}\n"
+            f"📛 *Username:* @{md_escape(uname or '—')}\n"
+            f"⏱ *Last Seen:* {last_seen}",
+            parse_mode="Markdown",
+        )
+    else:
+        send_message(
+            chat_id, "⚠️ You’re not registered yet. Try sending /start."
+        )
+
+
+def _handle_status(chat_id, rest, text):
+    try:
+        conn = get_conn()
+        active_tasks, total_users = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM task WHERE enabled=1), "
+            "(SELECT COUNT(*) FROM user_registry)"
+        ).fetchone()
+
+        jobs = scheduler.get_jobs()
+        job_count = len(jobs)
+
+        status_msg = (
+            f"🧾 *System Status:*\n\n"
+            f"👥 Total Users: {total_users}\n"
+            f"🕒 Active Tasks: {active_tasks}\n"
+            f"🗓️ Scheduled Jobs: {job_count}\n"
+            f"🕰️ Server Time: {datetime.datetime.now(TZ).strftime(TIME_FMT)}\n"
+        )
+        send_message(chat_id, status_msg, parse_mode="Markdown")
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Failed to fetch status: {e}")
+
+
+def _handle_list_reminders(chat_id, rest, text):
+    try:
+        conn = get_conn()
+        cur = conn.execute(
+            "SELECT id, params_json, schedule_rule, enabled "
+            "FROM task WHERE user_id=? AND enabled=1",
+            (task_owner_id(chat_id),),
+        )
+        rows = cur.fetchall()
+
+        if not rows:
+            send_message(chat_id, "ℹ️ You have no active reminders.")
             return
 
-        # --- /disconnect_gmail command ---
-        if text_lower.startswith("/disconnect_gmail"):
+        lines = []
+        for tid, params_json, rule, enabled in rows:
             try:
-                from src.tools.email_summary import disconnect_gmail
+                params = _parse_params(tid, params_json)
+                msg_text = params["calls"][0]["args"].get("text", "")
+                plan = params.get("plan", "")
+            except Exception:
+                msg_text = "(unreadable)"
+                plan = "unknown"
+            lines.append(
+                f"🆔 *{tid}* → ({md_escape(plan)}) {md_escape(msg_text)}\n   ⏱ {md_escape(rule)}"
+            )
+
+        msg_body = (
+            "📋 *Active Reminders & Orders:*\n\n"
+            + "\n\n".join(lines)
+            + "\n\nUse `/delete_reminder <id>` to delete a reminder."
+        )
+        send_message(chat_id, msg_body, parse_mode="Markdown")
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Failed to list reminders: {e}")
 
-                disconnect_gmail(chat_id)
-                send_message(chat_id, "✅ Your Gmail has been unlinked.")
-            except Exception as e:
-                send_message(chat_id, f"⚠️ Failed to unlink Gmail: {e}")
-            return
 
-        # --- /manual command (kept) ---
-        if text_lower.startswith("/manual"):
-            manual_text = (
-                "📖 *AI Micro Agent User Guide*\n\n"
-                "I can help you with reminders, orders, notes, and Gmail summaries. Here’s how to use me:\n\n"
-                "🕒 *Reminders*\n"
-                "• `/remind drink water every 2 hours` — set a reminder\n"
-                "• `/list_reminders` — list all your reminders\n"
-                "• `/delete_reminder <id>` — delete a reminder by its ID\n\n"
-                "🛒 *Orders*\n"
-                "• `/remind order milk from Capital Store` — immediate order\n"
-                "• `/remind order milk in 2 hours from Capital Store` — one-time delayed order\n"
-                "• `/remind order milk every 2 days from Capital Store` — recurring order\n"
-                "• Use `/endchat` to finish a buyer<->store chat\n\n"
-                "📝 *Notes*\n"
-                "• `/note buy fruits` — save a note\n"
-                "• `/notes` — list your notes\n"
-                "• `/delete_note <id>` — delete a note\n\n"
-                "💌 *Email Digest*\n"
-                "• `/link_gmail` — link your Gmail account\n"
-                "• `/emailsummary` — get an immediate Gmail digest (default 5)\n"
-                "• `/emailsummary 10` — get last 10 emails now\n"
-                "• `/emailsummary every day at 10am` — schedule daily digest\n"
-                "• `/emailsummary weekly on Mon at 9am` — schedule weekly digest\n\n"
-                "🧾 *Jobs & Info*\n"
-                "• `/list_jobs` — show scheduled jobs (next run times)\n"
-                "• `/whoami` — see your profile info\n\n"
-                "Feel free to ask for help! 🚀"
+def _handle_delete_reminder(chat_id, rest, text):
+    parts = text.split()
+    if len(parts) < 2:
+        send_message(chat_id, "Usage: /delete_reminder <reminder_id>")
+        return
+
+    try:
+        rid = int(parts[1])
+    except ValueError:
+        send_message(
+            chat_id, "Please provide a valid numeric reminder ID."
+        )
+        return
+
+    try:
+        # Only the owner's task is disabled; RETURNING tells us if it matched.
+        # Tasks whose user_id predates the stable registry ids are matched by
+        # the chat id stored in their call arguments instead.
+        row = get_conn().execute(
+            """
+            UPDATE task SET enabled=0
+            WHERE id=? AND (
+                user_id=?
+                OR CAST(COALESCE(
+                       json_extract(params_json, '$.calls[0].args.chat_id'),
+                       json_extract(params_json, '$.calls[0].args.buyer_chat_id')
+                   ) AS TEXT) = ?
             )
-            send_message(chat_id, manual_text, parse_mode="Markdown")
+            RETURNING id
+            """,
+            (rid, task_owner_id(chat_id), str(chat_id)),
+        ).fetchone()
+        if not row:
+            send_message(chat_id, f"⚠️ No reminder {rid} found.")
             return
 
-        # --- /list_jobs command ---
-        if text_lower.startswith("/list_jobs"):
-            try:
-                jobs = scheduler.get_jobs()
-                if not jobs:
-                    send_message(chat_id, "ℹ️ No active scheduled jobs.")
-                    return
+        _JOB_FINGERPRINT.pop(f"reminder-{rid}", None)
+        try:
+            scheduler.remove_job(f"reminder-{rid}")
+        except JobLookupError:
+            pass
 
-                lines = []
-                for job in jobs:
-                    nid = job.id
-                    try:
-                        nrt = job.next_run_time
-                        if nrt:
-                            nrt_local = nrt.astimezone(TZ).strftime(
-                                "%Y-%m-%d %H:%M:%S"
-                            )
-                        else:
-                            nrt_local = "—"
-                    except Exception:
-                        nrt_local = "—"
-                    lines.append(f"🆔 *{nid}*\n⏰ Next run: {nrt_local}")
-
-                msg = "🧾 *Scheduled Jobs:*\n\n" + "\n\n".join(lines)
-                send_message(chat_id, msg, parse_mode="Markdown")
-            except Exception as e:
-                send_message(chat_id, f"⚠️ Failed to list jobs: {e}")
+        send_message(
+            chat_id,
+            f"✅ Reminder *{rid}* deleted successfully.",
+            parse_mode="Markdown",
+        )
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Could not delete reminder {rid}: {e}")
+
+
+def _handle_link_gmail(chat_id, rest, text):
+    try:
+        send_message(chat_id, "🔗 Starting Gmail link process...")
+        # start_gmail_oauth sends the auth URL itself and blocks until the
+        # OAuth flow finishes, so deliver the notice first.
+        _flush_replies()
+        email_summary.start_gmail_oauth(chat_id)
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Failed to start Gmail linking: {e}")
+
+
+def _handle_check_gmail(chat_id, rest, text):
+    try:
+        linked = email_summary.check_gmail_link(chat_id)
+        if linked:
+            send_message(
+                chat_id, "✅ Your Gmail is linked successfully."
+            )
+        else:
+            send_message(
+                chat_id,
+                "⚠️ Your Gmail is not linked yet. Use /link_gmail to link.",
+            )
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Failed to check Gmail link: {e}")
+
+
+def _handle_disconnect_gmail(chat_id, rest, text):
+    try:
+        email_summary.disconnect_gmail(chat_id)
+        send_message(chat_id, "✅ Your Gmail has been unlinked.")
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Failed to unlink Gmail: {e}")
+
+
+_MANUAL_TEXT = (
+    "📖 *AI Micro Agent User Guide*\n\n"
+    "I can help you with reminders, orders, notes, and Gmail summaries. Here’s how to use me:\n\n"
+    "🕒 *Reminders*\n"
+    "• `/remind drink water every 2 hours` — set a reminder\n"
+    "• `/list_reminders` — list all your reminders\n"
+    "• `/delete_reminder <id>` — delete a reminder by its ID\n\n"
+    "🛒 *Orders*\n"
+    "• `/remind order milk from Capital Store` — immediate order\n"
+    "• `/remind order milk in 2 hours from Capital Store` — one-time delayed order\n"
+    "• `/remind order milk every 2 days from Capital Store` — recurring order\n"
+    "• Use `/endchat` to finish a buyer<->store chat\n\n"
+    "📝 *Notes*\n"
+    "• `/note buy fruits` — save a note\n"
+    "• `/notes` — list your notes\n"
+    "• `/delete_note <id>` — delete a note\n\n"
+    "💌 *Email Digest*\n"
+    "• `/link_gmail` — link your Gmail account\n"
+    "• `/emailsummary` — get an immediate Gmail digest (default 5)\n"
+    "• `/emailsummary 10` — get last 10 emails now\n"
+    "• `/emailsummary every day at 10am` — schedule daily digest\n"
+    "• `/emailsummary weekly on Mon at 9am` — schedule weekly digest\n\n"
+    "🧾 *Jobs & Info*\n"
+    "• `/list_jobs` — show scheduled jobs (next run times)\n"
+    "• `/whoami` — see your profile info\n\n"
+    "Feel free to ask for help! 🚀"
+)
+
+
+def _handle_manual(chat_id, rest, text):
+    send_message(chat_id, _MANUAL_TEXT, parse_mode="Markdown")
+
+
+def _handle_list_jobs(chat_id, rest, text):
+    try:
+        jobs = scheduler.get_jobs()
+        if not jobs:
+            send_message(chat_id, "ℹ️ No active scheduled jobs.")
             return
 
-        # --- /emailsummary handler (immediate, daily, weekly, N latest) ---
-        if text_lower.startswith("/emailsummary"):
-            try:
-                # immediate with optional count: "/emailsummary 10"
-                m_count = re.match(r"^/emailsummary\s+(\d+)\s*$", text_lower)
-                if m_count:
-                    maxn = int(m_count.group(1))
-                    send_message(
-                        chat_id,
-                        f"📬 Fetching your last {maxn} emails... please wait ⏳",
-                    )
-                    gmail_oauth.send_daily_email_summary(
-                        chat_id, max_results=maxn
-                    )
-                    return
+        lines = []
+        for job in jobs:
+            # Paused jobs have next_run_time=None
+            nrt = getattr(job, "next_run_time", None)
+            nrt_local = nrt.astimezone(TZ).strftime(TIME_FMT) if nrt else "—"
+            lines.append(f"🆔 *{job.id}*\n⏰ Next run: {nrt_local}")
 
-                # daily schedule: "emailsummary every day at 11am"
-                m_daily = re.search(
-                    r"every\s+day\s+at\s+(\d{1,2})(?::(\d{2}))?\s*(am|pm)?",
-                    text_lower,
-                )
-                if m_daily:
-                    hour = int(m_daily.group(1))
-                    minute = int(m_daily.group(2) or 0)
-                    ampm = m_daily.group(3)
-                    if ampm == "pm" and hour < 12:
-                        hour += 12
-                    elif ampm == "am" and hour == 12:
-                        hour = 0
-                    rrule = (
-                        f"RRULE:FREQ=DAILY;BYHOUR={hour};BYMINUTE={minute}"
-                    )
-                    plan = {
-                        "task_type": "email_summary",
-                        "schedule_rule": rrule,
-                        "text": "Daily Gmail summary",
-                    }
-                    tid = persist_task_and_schedule(chat_id, plan)
-                    if tid:
-                        send_message(
-                            chat_id,
-                            f"✅ Scheduled Gmail summary every day at {hour:02d}:{minute:02d}. (task id={tid})",
-                        )
-                    else:
-                        send_message(
-                            chat_id,
-                            "⚠️ Failed to schedule daily Gmail summary.",
-                        )
-                    return
+        msg = "🧾 *Scheduled Jobs:*\n\n" + "\n\n".join(lines)
+        send_message(chat_id, msg, parse_mode="Markdown")
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Failed to list jobs: {e}")
 
-                # weekly schedule: "emailsummary every week on monday at 9am"
-                weekday_map = {
-                    "monday": "MO",
-                    "mon": "MO",
-                    "tuesday": "TU",
-                    "tue": "TU",
-                    "wednesday": "WE",
-                    "wed": "WE",
-                    "thursday": "TH",
-                    "thu": "TH",
-                    "friday": "FR",
-                    "fri": "FR",
-                    "saturday": "SA",
-                    "sat": "SA",
-                    "sunday": "SU",
-                    "sun": "SU",
-                }
-                m_weekly = re.search(
-                    r"(?:every|weekly)\s*(?:week)?(?:\s*on)?\s*"
-                    r"(mon|monday|tue|tuesday|wed|wednesday|thu|thursday|fri|friday|sat|saturday|sun|sunday)\b"
-                    r"\s*(?:at\s*(\d{1,2})(?::(\d{2}))?\s*(am|pm)?)?",
-                    text_lower,
+
+# /emailsummary [N | every day at .. | weekly on .. at ..]
+def _handle_emailsummary(chat_id, rest, text):
+    try:
+        # immediate with optional count: "/emailsummary 10"
+        m_count = _RE_EMAILSUMMARY_COUNT.match(rest)
+        if m_count:
+            maxn = int(m_count.group(1))
+            send_message(
+                chat_id,
+                f"📬 Fetching your last {maxn} emails... please wait ⏳",
+            )
+            _flush_replies()
+            _run_in_background(_send_email_summary, chat_id, maxn)
+            return
+
+        # daily schedule: "emailsummary every day at 11am"
+        m_daily = _RE_EMAILSUMMARY_DAILY.search(rest)
+        if m_daily:
+            hour = int(m_daily.group(1))
+            minute = int(m_daily.group(2) or 0)
+            ampm = (m_daily.group(3) or "").lower()
+            if ampm == "pm" and hour < 12:
+                hour += 12
+            elif ampm == "am" and hour == 12:
+                hour = 0
+            rrule = (
+                f"RRULE:FREQ=DAILY;BYHOUR={hour};BYMINUTE={minute}"
+            )
+            plan = {
+                "task_type": "email_summary",
+                "schedule_rule": rrule,
+                "text": "Daily Gmail summary",
+            }
+            tid = persist_task_and_schedule(chat_id, plan)
+            if tid:
+                send_message(
+                    chat_id,
+                    f"✅ Scheduled Gmail summary every day at {hour:02d}:{minute:02d}. (task id={tid})",
                 )
-                if m_weekly:
-                    day_token = m_weekly.group(1).lower()
-                    hour = int(m_weekly.group(2) or 9)
-                    minute = int(m_weekly.group(3) or 0)
-                    ampm = m_weekly.group(4)
-                    if ampm == "pm" and hour < 12:
-                        hour += 12
-                    elif ampm == "am" and hour == 12:
-                        hour = 0
-                    byday = weekday_map.get(day_token, day_token.upper()[:2])
-                    rrule = (
-                        f"RRULE:FREQ=WEEKLY;BYDAY={byday};"
-                        f"BYHOUR={hour};BYMINUTE={minute}"
-                    )
-                    plan = {
-                        "task_type": "email_summary",
-                        "schedule_rule": rrule,
-                        "text": f"Weekly Gmail summary ({byday})",
-                    }
-                    tid = persist_task_and_schedule(chat_id, plan)
-                    if tid:
-                        send_message(
-                            chat_id,
-                            f"✅ Scheduled weekly Gmail summary on "
-                            f"{day_token.title()} at {hour:02d}:{minute:02d}. (task id={tid})",
-                        )
-                    else:
-                        send_message(
-                            chat_id,
-                            "⚠️ Failed to schedule weekly Gmail summary.",
-                        )
-                    return
+            else:
+                send_message(
+                    chat_id,
+                    "⚠️ Failed to schedule daily Gmail summary.",
+                )
+            return
 
-                # default immediate fetch
+        # weekly schedule: "emailsummary every week on monday at 9am"
+        m_weekly = _RE_EMAILSUMMARY_WEEKLY.search(rest)
+        if m_weekly:
+            day_token = m_weekly.group(1).lower()
+            hour = int(m_weekly.group(2) or 9)
+            minute = int(m_weekly.group(3) or 0)
+            ampm = (m_weekly.group(4) or "").lower()
+            if ampm == "pm" and hour < 12:
+                hour += 12
+            elif ampm == "am" and hour == 12:
+                hour = 0
+            byday = _WEEKDAY_MAP.get(day_token, day_token.upper()[:2])
+            rrule = (
+                f"RRULE:FREQ=WEEKLY;BYDAY={byday};"
+                f"BYHOUR={hour};BYMINUTE={minute}"
+            )
+            plan = {
+                "task_type": "email_summary",
+                "schedule_rule": rrule,
+                "text": f"Weekly Gmail summary ({byday})",
+            }
+            tid = persist_task_and_schedule(chat_id, plan)
+            if tid:
                 send_message(
                     chat_id,
-                    "📬 Fetching your Gmail summary... please wait ⏳",
+                    f"✅ Scheduled weekly Gmail summary on "
+                    f"{day_token.title()} at {hour:02d}:{minute:02d}. (task id={tid})",
+                )
+            else:
+                send_message(
+                    chat_id,
+                    "⚠️ Failed to schedule weekly Gmail summary.",
                 )
-                gmail_oauth.send_daily_email_summary(chat_id, max_results=5)
-            except Exception as e:
-                send_message(chat_id, f"⚠️ Failed to get email summary: {e}")
             return
 
-        # --- /remind command ---
-        if text_lower.startswith("/remind"):
-            parts = text.split(" ", 1)
-            if len(parts) < 2:
-                send_message(chat_id, "Usage: /remind <your instruction>")
+        # default immediate fetch
+        send_message(
+            chat_id,
+            "📬 Fetching your Gmail summary... please wait ⏳",
+        )
+        _flush_replies()
+        _run_in_background(_send_email_summary, chat_id, 5)
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Failed to get email summary: {e}")
+
+
+def _send_email_summary(chat_id, max_results):
+    try:
+        gmail_oauth.send_daily_email_summary(chat_id, max_results=max_results)
+    except Exception as e:
+        send_message(chat_id, f"⚠️ Failed to get email summary: {e}")
+
+
+def _split_schedule(tokens):
+    """
+    Peel a trailing schedule phrase off a token list.
+    Returns (n, schedule) where tokens[:n] is what precedes the phrase and
+    schedule is ("every", num, unit), ("in", num, unit) or None.
+    """
+    match tokens:
+        case [*head, "every", num, unit] if num.isdigit() and unit in _FREQ:
+            return len(head), ("every", int(num), unit)
+        case [*head, "every", unit] if unit in _FREQ:
+            return len(head), ("every", 1, unit)
+        case [*head, "in", num, unit] if num.isdigit() and unit in _DELAY_SECONDS:
+            return len(head), ("in", int(num), unit)
+    return len(tokens), None
+
+
+def _handle_remind(chat_id, rest, text):
+    nl_original = rest.strip()
+    if not nl_original:
+        send_message(chat_id, "Usage: /remind <your instruction>")
+        return
+
+    # Tokenize once; words keeps the user's casing for item/store/action text.
+    words = nl_original.split()
+    tokens = [w.lower().rstrip(".,!?") for w in words]
+
+    match tokens:
+        # ----- ORDER branch: order <item> [schedule] from <store> [schedule] -----
+        case ["order", *_] if "from" in tokens[1:]:
+            cut = len(tokens) - 1 - tokens[::-1].index("from")
+            n, schedule = _split_schedule(tokens[1:cut])
+            item_words = words[1 : 1 + n]
+            store_words = words[cut + 1 :]
+            if schedule is None:
+                n, schedule = _split_schedule(tokens[cut + 1 :])
+                store_words = store_words[:n]
+            # A schedule we couldn't place: don't turn it into an immediate order.
+            if schedule is None and _RE_REMIND_SCHEDULE.search(nl_original):
+                send_message(
+                    chat_id,
+                    "❌ Couldn't parse the order schedule. Try e.g. "
+                    "/remind order milk every 2 days from Capital Store",
+                )
                 return
+            _handle_order(chat_id, " ".join(item_words), " ".join(store_words), schedule)
+            return
 
-            nl_original = parts[1].strip()
-            nl = nl_original.lower()
+        # ----- REMINDER branch: <action> every N <unit> -----
+        case [*action, "every", num, unit] if action and num.isdigit() and unit in _FREQ:
+            _create_interval_reminder(chat_id, " ".join(words[: len(action)]), int(num), unit)
+            return
 
-            # ----- ORDER branch -----
-            if "order" in nl and "from" in nl:
-                idx = nl.rfind(" from ")
-                if idx == -1:
-                    send_message(chat_id, "❌ Couldn't parse store name.")
-                    return
+    # Regex fallback for looser phrasing ("every 2hours", trailing words, ...)
+    explicit = _RE_REMIND_EXPLICIT.search(nl_original)
+    if explicit:
+        _create_interval_reminder(
+            chat_id,
+            explicit.group("action").strip(),
+            int(explicit.group("num")),
+            explicit.group("unit").lower(),
+        )
+        return
+
+    # If no explicit time pattern → call Ollama (off the polling thread)
+    send_message(chat_id, f"Got it — I'll create a reminder for: \"{nl_original}\". Processing with Ollama...")
+    _flush_replies()
+    _run_in_background(_plan_reminder_with_llm, chat_id, nl_original)
+
+
+def _plan_reminder_with_llm(chat_id, nl_original):
+    """Turn a free-form /remind into a plan via Ollama, then persist it."""
+    system_prompt = (
+        "You are a JSON-only generator. Convert the user's instruction into a "
+        "single JSON object and output only that JSON object and nothing else. "
+        "The JSON must have exactly these keys: "
+        "\"task_type\" (one of 'reminder'|'bill_link'|'email_summary'), "
+        "\"schedule_rule\" (an iCalendar RRULE string like "
+        "'RRULE:FREQ=DAILY;BYHOUR=9;BYMINUTE=0'), "
+        "\"text\" (the message to send).\n\n"
+        f"Input: {nl_original}\nOutput:"
+    )
 
-                item_part = nl_original[:idx].replace("order", "", 1).strip()
-                store_part = nl_original[idx + len(" from ") :].strip()
-
-                # recurring
-                m_recurring = re.search(r"every\s*(\d+)?\s*(second|seconds|minute|minutes|hour|hours|day|days|week|weeks)\b", nl)
-                if m_recurring:
-                    num = int(m_recurring.group(1) or 1)
-                    unit = m_recurring.group(2)
-                    if "second" in unit:
-                        rrule = f"RRULE:FREQ=SECONDLY;INTERVAL={num}"
-                    elif "minute" in unit:
-                        rrule = f"RRULE:FREQ=MINUTELY;INTERVAL={num}"
-                    elif "hour" in unit:
-                        rrule = f"RRULE:FREQ=HOURLY;INTERVAL={num}"
-                    elif "day" in unit:
-                        rrule = f"RRULE:FREQ=DAILY;INTERVAL={num}"
-                    else:
-                        rrule = "RRULE:FREQ=DAILY;INTERVAL=1"
-                    plan = {"task_type": "order", "schedule_rule": rrule, "text": f"Order {item_part} from {store_part}"}
-                    tid = persist_task_and_schedule(chat_id, plan)
-                    send_message(chat_id, f"✅ Scheduled recurring order (task id={tid}).")
-                    return
+    raw = None
+    try:
+        raw = call_ollama(system_prompt)
+    except Exception as e:
+        logger.error("⚠️ Ollama call failed: %s", e)
 
-                # one-time (persistent MCP job)
-                m_once = re.search(r"in\s+(\d+)\s*(second|seconds|minute|minutes|hour|hours)\b", nl)
-                if m_once:
-                    num = int(m_once.group(1))
-                    unit = m_once.group(2)
-
-                    # Convert to seconds for timestamp calculation
-                    delay_seconds = num if "second" in unit else num * 60 if "minute" in unit else num * 3600
-                    run_at = (datetime.datetime.now(TZ) + datetime.timedelta(seconds=delay_seconds)).isoformat()
-
-                    # Build plan for MCP + DB
-                    plan = {
-                        "task_type": "order",
-                        "schedule_rule": f"RRULE:FREQ=ONCE;RUN_AT={run_at}",
-                        "text": f"Order {item_part} from {store_part}",
-                        "extra": {"store": store_part, "item": item_part}
-                    }
-
-                    tid = persist_task_and_schedule(chat_id, plan)
-                    if tid:
-                        send_message(chat_id, f"✅ Scheduled one-time order (task id={tid}) for *{item_part}* from *{store_part}* in {num} {unit}.")
-                    else:
-                        send_message(chat_id, "⚠️ Failed to schedule order.")
-                    return
+    plan = None
+    if raw:
+        try:
+            logger.debug("🔎 Model raw response preview:\n%s", raw[:500])
+            plan = extract_json_from_text(raw)
+        except Exception as e:
+            logger.warning("⚠️ Failed to parse LLM response: %s", e)
 
+    if not plan or not isinstance(plan, dict):
+        send_message(chat_id,
+            "⚠️ I couldn’t understand the timing. Please say it clearly, e.g.\n"
+            "`/remind drink water every 15 seconds`\n"
+            "`/remind stretch every 2 hours`",
+            parse_mode="Markdown")
+        return
 
-                orders.place_order(chat_id, store_part, item_part)
-                return
 
-            # ----- REMINDER branch -----
-            # Try pattern-based parsing first (simple interval reminders)
-            explicit = re.search(r"(?P<action>.+?)\s+every\s+(?P<num>\d+)\s*(?P<unit>second|seconds|minute|minutes|hour|hours|day|days)\b", nl)
-            if explicit:
-                action = explicit.group("action").strip()
-                num = int(explicit.group("num"))
-                unit = explicit.group("unit")
-
-                if "second" in unit:
-                    rrule = f"RRULE:FREQ=SECONDLY;INTERVAL={num}"
-                elif "minute" in unit:
-                    rrule = f"RRULE:FREQ=MINUTELY;INTERVAL={num}"
-                elif "hour" in unit:
-                    rrule = f"RRULE:FREQ=HOURLY;INTERVAL={num}"
-                elif "day" in unit:
-                    rrule = f"RRULE:FREQ=DAILY;INTERVAL={num}"
-                else:
-                    rrule = "RRULE:FREQ=HOURLY;INTERVAL=1"
-
-                plan = {
-                    "task_type": "reminder",
-                    "schedule_rule": rrule,
-                    "text": action.capitalize()
-                }
-                tid = persist_task_and_schedule(chat_id, plan)
-                if tid:
-                    send_message(chat_id, f"✅ Created reminder (task id={tid}). I’ll remind you to {action} per the schedule.")
-                else:
-                    send_message(chat_id, "⚠️ Failed to create reminder.")
-                return
+    tid = persist_task_and_schedule(chat_id, plan)
+    if tid:
+        send_message(chat_id, f"✅ Created reminder (task id={tid}). I’ll remind you per the schedule.")
+    else:
+        send_message(
+            chat_id,
+            "⚠️ Failed to create reminder. Please try again.",
+        )
 
-            # If no explicit time pattern → call Ollama
-            send_message(chat_id, f"Got it — I'll create a reminder for: \"{nl_original}\". Processing with Ollama...")
-
-            system_prompt = (
-                "You are a JSON-only generator. Convert the user's instruction into a "
-                "single JSON object and output only that JSON object and nothing else. "
-                "The JSON must have exactly these keys: "
-                "\"task_type\" (one of 'reminder'|'bill_link'|'email_summary'), "
-                "\"schedule_rule\" (an iCalendar RRULE string like "
-                "'RRULE:FREQ=DAILY;BYHOUR=9;BYMINUTE=0'), "
-                "\"text\" (the message to send).\n\n"
-                f"Input: {nl_original}\nOutput:"
-            )
 
-            raw = None
-            try:
-                raw = call_ollama(system_prompt)
-            except Exception as e:
-                print("⚠️ Ollama call failed:", e)
-
-            plan = None
-            if raw:
-                try:
-                    print("🔎 Model raw response preview:")
-                    print(raw[:500])
-                    plan = extract_json_from_text(raw)
-                except Exception as e:
-                    print("⚠️ Failed to parse LLM response:", e)
-
-            if not plan or not isinstance(plan, dict):
-                send_message(chat_id,
-                    "⚠️ I couldn’t understand the timing. Please say it clearly, e.g.\n"
-                    "`/remind drink water every 15 seconds`\n"
-                    "`/remind stretch every 2 hours`",
-                    parse_mode="Markdown")
-                return
+def _handle_order(chat_id, item_part, store_part, schedule):
+    if not item_part or not store_part:
+        send_message(chat_id, "❌ Couldn't parse the order. Usage: /remind order <item> from <store>")
+        return
 
+    match schedule:
+        # recurring
+        case ("every", num, unit):
+            rrule = f"RRULE:FREQ={_FREQ[unit]};INTERVAL={num}"
+            plan = {"task_type": "order", "schedule_rule": rrule, "text": f"Order {item_part} from {store_part}"}
+            tid = persist_task_and_schedule(chat_id, plan)
+            send_message(chat_id, f"✅ Scheduled recurring order (task id={tid}).")
+
+        # one-time (persistent MCP job)
+        case ("in", num, unit):
+            # Convert to seconds for timestamp calculation
+            delay_seconds = num * _DELAY_SECONDS[unit]
+            run_at = datetime.datetime.fromtimestamp(time.time() + delay_seconds, TZ).isoformat(timespec="seconds")
+
+            # Build plan for MCP + DB
+            plan = {
+                "task_type": "order",
+                "schedule_rule": f"RRULE:FREQ=ONCE;RUN_AT={run_at}",
+                "text": f"Order {item_part} from {store_part}",
+                "extra": {"store": store_part, "item": item_part}
+            }
 
             tid = persist_task_and_schedule(chat_id, plan)
             if tid:
-                send_message(chat_id, f"✅ Created reminder (task id={tid}). I’ll remind you per the schedule.")
+                send_message(chat_id, f"✅ Scheduled one-time order (task id={tid}) for {item_part} from {store_part} in {num} {unit}.")
             else:
-                send_message(
-                    chat_id,
-                    "⚠️ Failed to create reminder. Please try again.",
-                )
+                send_message(chat_id, "⚠️ Failed to schedule order.")
+
+        case None:
+            _flush_replies()
+            orders.place_order(chat_id, store_part, item_part)
+
+
+def _create_interval_reminder(chat_id, action, num, unit):
+    plan = {
+        "task_type": "reminder",
+        "schedule_rule": f"RRULE:FREQ={_FREQ.get(unit, 'DAILY')};INTERVAL={num}",
+        "text": action.capitalize()
+    }
+    tid = persist_task_and_schedule(chat_id, plan)
+    if tid:
+        send_message(chat_id, f"✅ Created reminder (task id={tid}). I’ll remind you to {action} per the schedule.")
+    else:
+        send_message(chat_id, "⚠️ Failed to create reminder.")
+
+
+_HANDLERS = {
+    "/note": _handle_note,
+    "/notes": _handle_notes,
+    "/delete_note": _handle_delete_note,
+    "/export_notes": _handle_export_notes,
+    "/agenda": _handle_agenda,
+    "/start": _handle_start,
+    "/systemcheck": _handle_systemcheck,
+    "/whoami": _handle_whoami,
+    "/status": _handle_status,
+    "/list_reminders": _handle_list_reminders,
+    "/delete_reminder": _handle_delete_reminder,
+    "/link_gmail": _handle_link_gmail,
+    "/connect_gmail": _handle_link_gmail,
+    "/check_gmail": _handle_check_gmail,
+    "/disconnect_gmail": _handle_disconnect_gmail,
+    "/manual": _handle_manual,
+    "/list_jobs": _handle_list_jobs,
+    "/emailsummary": _handle_emailsummary,
+    "/remind": _handle_remind,
+}
+
+
+def process_message(msg):
+    try:
+        chat = msg.get("chat", {})
+        chat_id = str(chat.get("id"))
+        username = chat.get("username")
+        display_name = (
+            chat.get("title")
+            or " ".join(filter(None, [chat.get("first_name"), chat.get("last_name")]))
+            or username
+            or ""
+        )
+        text = msg.get("text") or msg.get("caption") or ""
+        if not text:
             return
 
+        # keep user registry logic unchanged
+        register_user(chat_id, display_name, username)
+
+        # keep buyer <-> store chat forwarding logic unchanged
+        # (order_chat_session is created by init_db())
+        try:
+            conn = get_conn()
+            cur = conn.execute(
+                """
+                SELECT id, order_id, buyer_chat_id, store_chat_id
+                FROM order_chat_session
+                WHERE active=1 AND (buyer_chat_id=? OR store_chat_id=?)
+            """,
+                (chat_id, chat_id),
+            )
+            sess = cur.fetchone()
+            if sess:
+                sess_id, order_id, buyer_cid, store_cid = sess
+                # endchat preserved
+                stripped = text.strip()
+                if len(stripped) == 8 and stripped.lower() == "/endchat":
+                    conn.execute(
+                        "UPDATE order_chat_session SET active=0 WHERE id=?",
+                        (sess_id,),
+                    )
+                    wait([
+                        _io_pool.submit(send_message, buyer_cid, "💬 Chat closed."),
+                        _io_pool.submit(send_message, store_cid, "💬 Chat closed."),
+                    ])
+                    return
+                target = store_cid if chat_id == buyer_cid else buyer_cid
+                prefix = "👤 Customer" if chat_id == buyer_cid else "🏪 Store"
+                send_message(target, f"{prefix}:\n{text}")
+                return
+        except Exception:
+            pass
+
+        # One dict lookup on the command word instead of a startswith ladder;
+        # "/cmd@BotName" (group chats) resolves to the same handler. Split on
+        # any whitespace so "/note\nbuy milk" dispatches like "/note buy milk".
+        parts = text.split(None, 1)
+        if not parts:
+            return
+        handler = _HANDLERS.get(parts[0].lower().split("@", 1)[0])
+        if handler:
+            _reply.chat_id, _reply.buf = chat_id, OutBuffer()
+            try:
+                return handler(chat_id, parts[1] if len(parts) > 1 else "", text)
+            finally:
+                buf, _reply.buf = _reply.buf, None
+                buf.flush(chat_id)
+
     except Exception as e:
-         print("⚠️ process_message error:", e)
+        logger.exception("⚠️ process_message error: %s", e)
 
 
 def handle_callback_query(callback_query):
@@ -1139,36 +1396,72 @@ def handle_callback_query(callback_query):
         else:
             orders.handle_buyer_callback(data, user_id)
     except Exception as e:
-        print("⚠️ handle_callback_query error:", e)
+        logger.exception("⚠️ handle_callback_query error: %s", e)
+
+
+# Only the update kinds main_loop handles; Telegram filters out the rest.
+ALLOWED_UPDATES = json.dumps(["message", "callback_query"])
+# Long-poll: Telegram holds getUpdates open until an update arrives or this
+# many seconds pass, so the loop needs no sleep of its own between polls.
+POLL_TIMEOUT = 50
+# The server already tracks the offset between polls; the file only matters
+# across restarts, so write it every N updates or after a quiet period.
+OFFSET_SAVE_EVERY = 10
+OFFSET_SAVE_INTERVAL = 2  # seconds
+# Failed polls back off exponentially (doubling) up to the cap; a good poll resets it.
+BACKOFF_MIN = 2
+BACKOFF_MAX = 60  # seconds
 
 
 def main_loop():
     offset = load_offset()
-    print("✅ Telegram listener started (polling getUpdates).")
-    while True:
+    saved_offset, saved_at = offset, time.monotonic()
+    backoff = BACKOFF_MIN
+    logger.info("✅ Telegram listener started (polling getUpdates).")
+    try:
+        while True:
+            try:
+                params = {"timeout": POLL_TIMEOUT, "allowed_updates": ALLOWED_UPDATES}
+                if offset:
+                    params["offset"] = offset
+                r = TG_SESSION.get(
+                    f"{TG_BASE}/getUpdates", params=params, timeout=POLL_TIMEOUT + 5
+                )
+                data = r.json()
+                if not data.get("ok"):
+                    logger.warning("⚠️ getUpdates not ok: %s (retry in %ss)", data.get("description"), backoff)
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, BACKOFF_MAX)
+                    continue
+                backoff = BACKOFF_MIN
+                for upd in data.get("result", []):
+                    offset = upd["update_id"] + 1
+                    if "message" in upd:
+                        process_message(upd["message"])
+                    elif "callback_query" in upd:
+                        handle_callback_query(upd["callback_query"])
+                if offset != saved_offset and (
+                    offset - (saved_offset or 0) >= OFFSET_SAVE_EVERY
+                    or time.monotonic() - saved_at > OFFSET_SAVE_INTERVAL
+                ):
+                    save_offset(offset)
+                    saved_offset, saved_at = offset, time.monotonic()
+            except Exception as e:
+                logger.error("⚠️ Telegram listener error: %s (retry in %ss)", e, backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, BACKOFF_MAX)
+    finally:
+        # Saves above are throttled and go through the background writer;
+        # write the last handled offset synchronously on shutdown (e.g. Ctrl+C).
+        # A pending queued offset is older, so discard it first.
         try:
-            params = {"timeout": 30}
-            if offset:
-                params["offset"] = offset
-            r = requests.get(
-                f"{TG_BASE}/getUpdates", params=params, timeout=40
-            )
-            data = r.json()
-            if not data.get("ok"):
-                time.sleep(2)
-                continue
-            for upd in data.get("result", []):
-                offset = upd["update_id"] + 1
-                save_offset(offset)
-                if "message" in upd:
-                    process_message(upd["message"])
-                elif "callback_query" in upd:
-                    handle_callback_query(upd["callback_query"])
-            time.sleep(0.5)
-        except Exception as e:
-            print("⚠️ Telegram listener error:", e)
-            time.sleep(2)
+            _offset_q.get_nowait()
+        except queue.Empty:
+            pass
+        if offset:
+            _write_offset(offset)
 
 
 if __name__ == "__main__":
+    setup_logger()
     main_loop()
@@ -6,7 +6,7 @@ from email import message_from_bytes
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
-from src.tools.messaging import send_message
+from src.tools.messaging import send_message, md_escape
 
 # ───────────────────────────────
 # CONFIG
@@ -113,9 +113,9 @@ def send_daily_email_summary(chat_id: str, max_results: int = 5):
         summary_lines = []
         for e in emails:
             line = (
-                f"📧 *From:* {e['from']}\n"
-                f"✉️ *Subject:* {e['subject']}\n"
-                f"📝 {e['body'][:150]}...\n"
+                f"📧 *From:* {md_escape(e['from'])}\n"
+                f"✉️ *Subject:* {md_escape(e['subject'])}\n"
+                f"📝 {md_escape(e['body'][:150])}...\n"
                 f"──────────────────────────────"
             )
             summary_lines.append(line)
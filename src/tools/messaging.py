@@ -1,8 +1,9 @@
 # src/tools/messaging.py
 import os
-import asyncio
-import aiohttp
 import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 # Force-load environment variables from project root
@@ -13,33 +14,84 @@ logger = logging.getLogger("ai_agent")
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
+# Shared keep-alive session for all Bot API calls (sendMessage, getUpdates,
+# sendDocument, inline keyboards), so each call skips the TCP/TLS handshake.
+# Only connection failures and 429/5xx on idempotent methods are retried.
+TG_SESSION = requests.Session()
+TG_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+        ),
+    ),
+)
 
-async def _send_async(chat_id: str, text: str, parse_mode: str | None = None):
-    """Send a Telegram message asynchronously with optional parse mode."""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {"chat_id": chat_id, "text": text}
-    if parse_mode:
-        payload["parse_mode"] = parse_mode
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload) as resp:
-            body = await resp.text()
-            if resp.status != 200:
-                logger.error(f"Telegram error {resp.status}: {body}")
-                print(f"❌ Telegram error {resp.status}: {body}")
-            else:
-                logger.info(f"✅ Sent Telegram message to {chat_id}: {text}")
-                print(f"✅ Telegram message sent to {chat_id}: {text}")
+
+TG_SEND_URL = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
 
 
 def send_message(chat_id: str, text: str, parse_mode: str | None = None):
-    """Wrapper for _send_async so you can call send_message(chat_id, text, parse_mode='Markdown')."""
+    """Send a Telegram message, e.g. send_message(chat_id, text, parse_mode='Markdown')."""
+    payload = {"chat_id": chat_id, "text": text}
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
     try:
-        asyncio.run(_send_async(chat_id, text, parse_mode))
+        resp = TG_SESSION.post(TG_SEND_URL, json=payload, timeout=10)
+        if resp.status_code != 200:
+            logger.error("❌ Telegram error %s: %s", resp.status_code, resp.text)
+        else:
+            logger.debug("✅ Sent Telegram message to %s: %s", chat_id, text)
     except Exception as e:
-        logger.error(f"❌ Failed to send message: {e}")
-        print("❌ Telegram send error:", e)
+        logger.error("❌ Failed to send message: %s", e)
+
+
+# Characters legacy Markdown treats as entity delimiters.
+_MD_SPECIAL = str.maketrans({c: "\\" + c for c in "_*`["})
+
+
+def md_escape(text) -> str:
+    """Escape user-provided text before embedding it in a Markdown message."""
+    return str(text).translate(_MD_SPECIAL)
+
+
+TG_MAX_MESSAGE = 4096  # Telegram's sendMessage text limit
+
+
+class OutBuffer:
+    """
+    Collects replies for one chat and sends them together.
+    flush() joins consecutive messages with the same parse_mode (blank line
+    between them) as long as the result fits in one Telegram message.
+    """
+
+    def __init__(self):
+        self._items = []
+
+    def add(self, text: str, parse_mode: str | None = None):
+        self._items.append((text, parse_mode))
 
+    def flush(self, chat_id: str):
+        items, self._items = self._items, []
+        chunk, mode = None, None
+        for text, parse_mode in items:
+            if (
+                chunk is not None
+                and parse_mode == mode
+                and len(chunk) + 2 + len(text) <= TG_MAX_MESSAGE
+            ):
+                chunk += "\n\n" + text
+                continue
+            if chunk is not None:
+                send_message(chat_id, chunk, parse_mode=mode)
+            chunk, mode = text, parse_mode
+        if chunk is not None:
+            send_message(chat_id, chunk, parse_mode=mode)
 
 
 if __name__ == "__main__":
-    send_message(CHAT_ID, "✅ Hello Nishtha! Test message from AI Micro Agent.", parse_mode="Markdown")
+    send_message(CHAT_ID, "✅ Hello Nishtha! Test message from AI Micro Agent.")
@@ -1,16 +1,18 @@
 import os
 import json
-import requests
+import logging
 import datetime
 from dotenv import load_dotenv
 from src.db import get_conn
-from src.tools.messaging import send_message
+from src.tools.messaging import send_message, md_escape, TG_SESSION
 
 # Load environment variables
 load_dotenv()
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TG_BASE = f"https://api.telegram.org/bot{BOT_TOKEN}"
 
+logger = logging.getLogger("ai_agent")
+
 
 # ────────────────────────────────────────────────
 # 🧩 Helper: Resolve store from registry
@@ -18,10 +20,7 @@ TG_BASE = f"https://api.telegram.org/bot{BOT_TOKEN}"
 def get_chat_id_by_name(name: str):
     """Fetch chat_id by name from user_registry."""
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT chat_id FROM user_registry WHERE LOWER(name)=?", (name.lower(),))
-    row = cur.fetchone()
-    conn.close()
+    row = conn.execute("SELECT chat_id FROM user_registry WHERE LOWER(name)=?", (name.lower(),)).fetchone()
     return str(row[0]) if row else None
 
 
@@ -39,25 +38,9 @@ def place_order(buyer_chat_id: str, store_identifier: str, item: str):
         )
         return
 
-    # Create order_status table if not exists
+    # Insert order record (order_status is created by init_db())
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS order_status (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            buyer_chat_id TEXT,
-            store_chat_id TEXT,
-            store_name TEXT,
-            item TEXT,
-            status TEXT,
-            created_at TEXT,
-            updated_at TEXT
-        )
-    """)
-    conn.commit()
-
-    # Insert order record
-    cur.execute(
+    cur = conn.execute(
         """
         INSERT INTO order_status (
             buyer_chat_id, store_chat_id, store_name, item, status, created_at, updated_at
@@ -73,14 +56,12 @@ def place_order(buyer_chat_id: str, store_identifier: str, item: str):
             datetime.datetime.now().isoformat(),
         ),
     )
-    conn.commit()
     order_id = cur.lastrowid
-    conn.close()
 
     # Send order message to store
     payload = {
         "chat_id": store_chat_id,
-        "text": f"🛒 *New Order from Customer*\n\n📦 Item: *{item}*\nWould you like to accept it?",
+        "text": f"🛒 *New Order from Customer*\n\n📦 Item: {md_escape(item)}\nWould you like to accept it?",
         "parse_mode": "Markdown",
         "reply_markup": json.dumps({
             "inline_keyboard": [
@@ -92,12 +73,12 @@ def place_order(buyer_chat_id: str, store_identifier: str, item: str):
         })
     }
 
-    res = requests.post(f"{TG_BASE}/sendMessage", data=payload)
+    res = TG_SESSION.post(f"{TG_BASE}/sendMessage", data=payload)
     if res.status_code == 200:
         send_message(buyer_chat_id, f"✅ Order sent to *{store_identifier}* for *{item}*.")
     else:
         send_message(buyer_chat_id, f"⚠️ Failed to deliver order to *{store_identifier}*.")
-        print("❌ Telegram API error:", res.text)
+        logger.error("❌ Telegram API error: %s", res.text)
 
 
 # ────────────────────────────────────────────────
@@ -112,40 +93,34 @@ def handle_store_callback(callback_data: str, store_chat_id: str):
         return
 
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT buyer_chat_id, item, store_name FROM order_status WHERE id=?", (order_id,))
-    row = cur.fetchone()
+    row = conn.execute("SELECT buyer_chat_id, item, store_name FROM order_status WHERE id=?", (order_id,)).fetchone()
     if not row:
-        conn.close()
         return
 
     buyer_chat_id, item, store_name = row
 
     # Store accepts the order
     if action == "accept":
-        cur.execute(
+        conn.execute(
             "UPDATE order_status SET status=?, updated_at=? WHERE id=?",
             ("accepted", datetime.datetime.now().isoformat(), order_id)
         )
-        conn.commit()
         send_message(buyer_chat_id, f"✅ *{store_name}* accepted your order for *{item}*! Proceed with payment 💸.")
         send_message(store_chat_id, f"👍 You accepted the order for *{item}*.")
 
     # Store marks item as out of stock
     elif action == "out":
-        cur.execute(
+        conn.execute(
             "UPDATE order_status SET status=?, updated_at=? WHERE id=?",
             ("out_of_stock", datetime.datetime.now().isoformat(), order_id)
         )
-        conn.commit()
 
         payload = {
             "chat_id": buyer_chat_id,
             "text": (
-                f"⚠️ *{store_name}* reports *{item}* is out of stock.\n"
+                f"⚠️ {store_name} reports {item} is out of stock.\n"
                 f"Would you like to skip or chat with the store?"
             ),
-            "parse_mode": "Markdown",
             "reply_markup": json.dumps({
                 "inline_keyboard": [
                     [
@@ -156,11 +131,9 @@ def handle_store_callback(callback_data: str, store_chat_id: str):
             })
         }
 
-        requests.post(f"{TG_BASE}/sendMessage", data=payload)
+        TG_SESSION.post(f"{TG_BASE}/sendMessage", data=payload)
         send_message(store_chat_id, f"📦 You marked *{item}* as out of stock.")
 
-    conn.close()
-
 
 # ────────────────────────────────────────────────
 # 👩‍💼 Buyer-side button handling (Skip / Chat)
@@ -174,22 +147,18 @@ def handle_buyer_callback(callback_data: str, buyer_chat_id: str):
         return
 
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT store_chat_id, item, store_name FROM order_status WHERE id=?", (order_id,))
-    row = cur.fetchone()
+    row = conn.execute("SELECT store_chat_id, item, store_name FROM order_status WHERE id=?", (order_id,)).fetchone()
     if not row:
-        conn.close()
         return
 
     store_chat_id, item, store_name = row
 
     # Buyer skips the order
     if action == "skip":
-        cur.execute(
+        conn.execute(
             "UPDATE order_status SET status=?, updated_at=? WHERE id=?",
             ("skipped", datetime.datetime.now().isoformat(), order_id)
         )
-        conn.commit()
         send_message(store_chat_id, f"ℹ️ Customer skipped the order for *{item}* this time.")
         send_message(buyer_chat_id, f"✅ You skipped the order from *{store_name}* this time.")
 
@@ -198,25 +167,11 @@ def handle_buyer_callback(callback_data: str, buyer_chat_id: str):
         send_message(buyer_chat_id, f"💬 Starting a chat with *{store_name}*.")
         send_message(store_chat_id, f"💬 Customer wants to chat regarding *{item}*.")
 
-        # Create or update active chat session
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS order_chat_session (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                order_id INTEGER,
-                buyer_chat_id TEXT,
-                store_chat_id TEXT,
-                active INTEGER DEFAULT 1
-            )
-        """)
-        conn.commit()
-
-        cur.execute(
+        # Create active chat session (order_chat_session is created by init_db())
+        conn.execute(
             "INSERT INTO order_chat_session (order_id, buyer_chat_id, store_chat_id, active) VALUES (?, ?, ?, 1)",
             (order_id, str(buyer_chat_id), str(store_chat_id))
         )
-        conn.commit()
 
         send_message(buyer_chat_id, "💬 You can now chat directly. Type /endchat to finish.")
         send_message(store_chat_id, "💬 You are now in a chat with the customer. Type /endchat to end the session.")
-
-    conn.close()
@@ -1,15 +1,43 @@
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import inch
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase.pdfmetrics import stringWidth
+import io
 from datetime import datetime
 from pathlib import Path
+from src.db import format_note_time
 
-def generate_notes_pdf(notes, output_path="notes_export.pdf"):
+BODY_FONT, BODY_SIZE = "Helvetica", 12
+
+
+def _wrap(text, max_width):
+    """Split text into lines no wider than max_width points in the body font."""
+    lines = []
+    # simpleSplit wraps on word boundaries by measured width but keeps a word
+    # wider than the line whole; those are broken glyph by glyph.
+    for line in simpleSplit(text, BODY_FONT, BODY_SIZE, max_width) or [""]:
+        if stringWidth(line, BODY_FONT, BODY_SIZE) <= max_width:
+            lines.append(line)
+            continue
+        start, w = 0, 0.0
+        for i, ch in enumerate(line):
+            cw = stringWidth(ch, BODY_FONT, BODY_SIZE)
+            if w + cw > max_width and i > start:
+                lines.append(line[start:i])
+                start, w = i, 0.0
+            w += cw
+        lines.append(line[start:])
+    return lines
+
+
+def render_notes_pdf(notes):
     """
-    notes: list of tuples (id, text, created_at, pinned)
-    output_path: file to save
+    notes: list of tuples (id, text, created_at, pinned) as returned by list_notes
+    Returns the PDF as bytes, built entirely in memory.
     """
-    c = canvas.Canvas(output_path, pagesize=A4)
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
     width, height = A4
 
     y = height - 1 * inch
@@ -28,26 +56,41 @@ def generate_notes_pdf(notes, output_path="notes_export.pdf"):
     c.line(1 * inch, y, width - 1 * inch, y)
     y -= 0.4 * inch
 
-    c.setFont("Helvetica", 12)
+    # One text object per page: lines are emitted as text-line operators
+    # instead of a positioned drawString call each.
+    def page_text(top):
+        t = c.beginText(1 * inch, top)
+        t.setFont(BODY_FONT, BODY_SIZE)
+        t.setLeading(0.25 * inch)
+        return t
+
+    tobj = page_text(y)
+    max_width = width - 2 * inch
 
     for nid, text, created_at, pinned in notes:
         star = "⭐ " if pinned else ""
-        line = f"{star}{nid}) {text}   ({created_at})"
+        line = f"{star}{nid}) {text}   ({format_note_time(created_at)})"
 
-        # If line too long, wrap manually
-        max_chars = 80
-        lines = [line[i:i+max_chars] for i in range(0, len(line), max_chars)]
-
-        for l in lines:
-            if y < 1 * inch:
+        for l in _wrap(line, max_width):
+            if tobj.getY() < 1 * inch:
+                c.drawText(tobj)
                 c.showPage()
-                y = height - 1 * inch
-                c.setFont("Helvetica", 12)
+                tobj = page_text(height - 1 * inch)
 
-            c.drawString(1 * inch, y, l)
-            y -= 0.25 * inch
+            tobj.textLine(l)
 
-        y -= 0.1 * inch
+        # Small gap between notes
+        tobj.setTextOrigin(1 * inch, tobj.getY() - 0.1 * inch)
 
+    c.drawText(tobj)
     c.save()
+    return buf.getvalue()
+
+
+def generate_notes_pdf(notes, output_path="notes_export.pdf"):
+    """
+    notes: list of tuples (id, text, created_at, pinned) as returned by list_notes
+    output_path: file to save (written in a single call)
+    """
+    Path(output_path).write_bytes(render_notes_pdf(notes))
     return output_path
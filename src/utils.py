@@ -3,6 +3,7 @@ from datetime import datetime, timezone
 import hashlib
 import logging
 import sys
+from logging.handlers import RotatingFileHandler
 
 sys.stdout.reconfigure(encoding='utf-8')
 
@@ -21,13 +22,22 @@ def setup_logger():
     logger = logging.getLogger("ai_agent")
     logger.setLevel(logging.INFO)
 
-    fh = logging.FileHandler("ai_agent.log", encoding="utf-8")
+    # Rotate so a long-running listener can't grow the log without bound.
+    fh = RotatingFileHandler(
+        "ai_agent.log", maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8"
+    )
     fh.setLevel(logging.INFO)
 
+    # Console output for what used to be print() diagnostics.
+    sh = logging.StreamHandler()
+    sh.setLevel(logging.INFO)
+
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     fh.setFormatter(formatter)
+    sh.setFormatter(formatter)
 
     if not logger.handlers:
         logger.addHandler(fh)
+        logger.addHandler(sh)
 
     return logger
@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# src.db binds DATABASE_URL at import and the listener refuses to start without
+# a bot token, so both are set before any test module imports them.
+os.environ.setdefault(
+    "DATABASE_URL",
+    "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="ai_agent_test_"), "agent.db"),
+)
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+
+import pytest
+
+from src import db
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """Point src.db at an empty file and reset its per-process state."""
+    path = tmp_path / "agent.db"
+    monkeypatch.setattr(db, "DB_FILE", str(path))
+    monkeypatch.setattr(db, "_db_ready", False)
+    monkeypatch.setattr(db, "_wal_enabled", False)
+    monkeypatch.setattr(db, "_tls", threading.local())
+    monkeypatch.setattr(db, "_writer_conn", None)
+    yield path
+    db._close_all()
+
+
+def test_legacy_note_created_at_is_migrated(fresh_db):
+    # Schema as shipped before created_at became an epoch integer.
+    legacy = sqlite3.connect(fresh_db)
+    legacy.executescript("""
+        CREATE TABLE note (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_chat_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            pinned INTEGER DEFAULT 0
+        );
+        CREATE INDEX idx_note_user_pin_time
+            ON note (user_chat_id, pinned DESC, created_at DESC);
+        INSERT INTO note (user_chat_id, text, created_at)
+            VALUES ('42', 'old', '2025-01-01T10:00:00.123456');
+    """)
+    legacy.commit()
+    legacy.close()
+
+    db.init_db()
+    new_id = db.create_note("42", "new")
+
+    conn = db.get_conn()
+    types = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(note)")}
+    assert types["created_at"] == "INTEGER"
+    assert "deleted_at" in types
+    assert conn.execute(
+        "SELECT DISTINCT typeof(created_at) FROM note"
+    ).fetchall() == [("integer",)]
+    assert conn.execute(
+        "SELECT created_at FROM note WHERE text = 'old'"
+    ).fetchone()[0] == 1735725600
+
+    # Newest first, as /notes, /agenda and the PDF export expect.
+    assert [row[1] for row in db.list_notes("42")] == ["new", "old"]
+    assert db.list_notes("42")[0][0] == new_id
+    assert db.format_note_time(db.list_notes("42")[1][2]) == "2025-01-01 10:00"
+
+
+def test_list_notes_uses_covering_index(fresh_db):
+    old = sqlite3.connect(fresh_db)
+    old.executescript("""
+        CREATE TABLE note (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_chat_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            pinned INTEGER DEFAULT 0,
+            deleted_at INTEGER
+        );
+        CREATE INDEX idx_note_user_pin_time
+            ON note (user_chat_id, pinned DESC, created_at DESC);
+    """)
+    old.close()
+
+    db.init_db()
+
+    conn = db.get_conn()
+    indexes = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'note'"
+    )}
+    assert "idx_note_user_pin_time" not in indexes
+    plan = " ".join(row[3] for row in conn.execute(
+        "EXPLAIN QUERY PLAN " + db._SQL_LIST_NOTES, ("42",)
+    ))
+    assert "COVERING INDEX idx_note_live_user_pin_time" in plan
+
+
+def test_task_owners_are_backfilled_from_params(fresh_db):
+    db.init_db()
+    conn = db.get_conn()
+    conn.execute("PRAGMA user_version = 0")
+    conn.execute(
+        "INSERT INTO user_registry (id, chat_id, name) VALUES (7, '42', 'a'), (8, '99', 'b')"
+    )
+    # Owner ids 3 and 4 were handed out by registry rows that have since been replaced.
+    reminder = db.create_task(3, "reminder", {"calls": [{"args": {"chat_id": "42"}}]})
+    order = db.create_task(4, "order", {"calls": [{"args": {"buyer_chat_id": "99"}}]})
+    orphan = db.create_task(5, "reminder", {"calls": [{"args": {"chat_id": "1000"}}]})
+
+    db._backfill_task_owners(conn)
+
+    owners = dict(conn.execute("SELECT id, user_id FROM task"))
+    assert owners == {reminder: 7, order: 8, orphan: 5}
+
+
+def test_task_owner_backfill_runs_once(fresh_db):
+    db.init_db()
+    assert db.get_conn().execute("PRAGMA user_version").fetchone()[0] == 1
@@ -0,0 +1,82 @@
+import pytest
+
+from src import telegram_listener as listener
+
+
+@pytest.mark.parametrize(
+    "tokens, expected",
+    [
+        (["milk"], (1, None)),
+        (["milk", "every", "2", "days"], (1, ("every", 2, "days"))),
+        (["capital", "store", "every", "day"], (2, ("every", 1, "day"))),
+        (["milk", "in", "2", "hours"], (1, ("in", 2, "hours"))),
+        # "in" only takes units a one-time delay can be computed for
+        (["milk", "in", "2", "weeks"], (4, None)),
+        # numbers must be digits
+        (["milk", "every", "two", "days"], (4, None)),
+        ([], (0, None)),
+    ],
+)
+def test_split_schedule(tokens, expected):
+    assert listener._split_schedule(tokens) == expected
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Record what /remind would send, schedule or place instead of doing it."""
+    log = []
+    monkeypatch.setattr(listener, "send_message", lambda chat_id, text, parse_mode=None: log.append(("message", text)))
+    monkeypatch.setattr(listener, "_flush_replies", lambda: None)
+    monkeypatch.setattr(listener, "_run_in_background", lambda fn, *args: log.append(("llm", args[-1])))
+    monkeypatch.setattr(listener, "persist_task_and_schedule", lambda chat_id, plan: log.append(("task", plan)) or 1)
+    monkeypatch.setattr(
+        listener.orders, "place_order", lambda chat_id, store, item: log.append(("order", item, store))
+    )
+    return log
+
+
+def _remind(rest):
+    listener._handle_remind(42, rest, "/remind " + rest)
+
+
+@pytest.mark.parametrize(
+    "rest, text, rule",
+    [
+        ("order milk every 2 days from Capital Store",
+         "Order milk from Capital Store", "RRULE:FREQ=DAILY;INTERVAL=2"),
+        ("order milk from Capital Store every day",
+         "Order milk from Capital Store", "RRULE:FREQ=DAILY;INTERVAL=1"),
+        ("drink water every 2 hours", "Drink water", "RRULE:FREQ=HOURLY;INTERVAL=2"),
+    ],
+)
+def test_remind_schedules_recurring_task(calls, rest, text, rule):
+    _remind(rest)
+    task = calls[0][1]
+    assert (task["text"], task["schedule_rule"]) == (text, rule)
+
+
+@pytest.mark.parametrize(
+    "rest, item, store",
+    [
+        ("order milk from Capital Store", "milk", "Capital Store"),
+        # the store is whatever follows the last "from"
+        ("order cake from scratch kit from Baker Store", "cake from scratch kit", "Baker Store"),
+    ],
+)
+def test_remind_places_immediate_order(calls, rest, item, store):
+    _remind(rest)
+    assert calls == [("order", item, store)]
+
+
+def test_remind_schedules_one_time_order(calls):
+    _remind("order milk in 2 hours from Capital Store")
+    task = calls[0][1]
+    assert task["task_type"] == "order"
+    assert task["schedule_rule"].startswith("RRULE:FREQ=ONCE;RUN_AT=")
+    assert task["extra"] == {"store": "Capital Store", "item": "milk"}
+
+
+def test_remind_rejects_unplaceable_order_schedule(calls):
+    _remind("order milk in 2 weeks from Capital Store")
+    assert [kind for kind, *_ in calls] == ["message"]
+    assert "Couldn't parse the order schedule" in calls[0][1]